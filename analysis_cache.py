@@ -0,0 +1,249 @@
+"""
+Analysis cache: finished searches saved in a fixed-size, memory-mapped
+file that any number of processes open at once. A position searched by
+one game, self-play worker or server process is a lookup for all the
+others, and for every later run, since opening the file maps it instead
+of reading it.
+
+File layout (little endian): a header of magic, version and slot count,
+then slots of two 64-bit words: the entry's key XOR its data, and the
+data. Writes take no locks; a slot torn by two processes writing it at
+once fails the XOR check and just never matches a key. Slots come in buckets of
+four, a key can live in any slot of its bucket and a full bucket gives
+up its shallowest search.
+
+Entries hold the depth, bound, score and best column of a search from
+the side to move's point of view. Keys are opening book keys (mirror
+images share an entry when the evaluation treats them the same) salted
+with the board size, line length and evaluation, so one file serves every
+kind of game.
+"""
+
+
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+from connect_four import WINDOW_EVALUATION, EXACT
+from opening_book import get_book_key
+
+
+
+CACHE_MAGIC = b"C4AC"
+CACHE_VERSION = 1
+HEADER = struct.Struct("<4sBxxxQ")
+# Leaves the slots starting on a cache line
+HEADER_SIZE = 64
+SLOT = struct.Struct("<QQ")
+# depth, bound, column, score
+ENTRY = struct.Struct("<BBbxi")
+BUCKET_SLOTS = 4
+DEFAULT_CACHE_MB = 64
+
+
+
+def get_salt(height, width, win_length, evaluation):
+    # Seeding with a string is the same in every process
+    return random.Random(f"{height}x{width}x{win_length} {evaluation}").getrandbits(64)
+
+
+class AnalysisCache:
+    def __init__(self, path, size_mb=DEFAULT_CACHE_MB, read_only=False):
+        # Creates the file at size_mb if it doesn't exist yet. Existing
+        # files keep the size they were made with
+        if not os.path.exists(path):
+            create_cache(path, size_mb)
+        self.file = open(path, "rb" if read_only else "r+b")
+        access = mmap.ACCESS_READ if read_only else mmap.ACCESS_WRITE
+        self.data = mmap.mmap(self.file.fileno(), 0, access=access)
+        magic, version, self.slots = HEADER.unpack_from(self.data)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not an analysis cache")
+        if len(self.data) < HEADER_SIZE + self.slots * SLOT.size:
+            self.close()
+            raise ValueError(f"{path} is truncated")
+        self.buckets = self.slots // BUCKET_SLOTS
+        self.read_only = read_only
+        self.salts = {}
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def get_key(self, board, evaluation):
+        salt_key = (board.height, board.width, board.win_length, evaluation)
+        if salt_key not in self.salts:
+            self.salts[salt_key] = get_salt(*salt_key)
+        # Only the window evaluation scores mirror images the same
+        key, mirrored = get_book_key(board, evaluation == WINDOW_EVALUATION)
+        return key ^ self.salts[salt_key], mirrored
+
+    def get_slot(self, index):
+        # (key, data) of a slot, or None if it's empty or torn
+        check, data = SLOT.unpack_from(self.data, HEADER_SIZE + index * SLOT.size)
+        if data == 0:
+            return None
+        return check ^ data, data
+
+    def write_slot(self, index, key, data):
+        SLOT.pack_into(self.data, HEADER_SIZE + index * SLOT.size, key ^ data, data)
+
+    def lookup(self, key):
+        # (depth, bound, column, score) stored for key, or None
+        first = (key % self.buckets) * BUCKET_SLOTS
+        for index in range(first, first + BUCKET_SLOTS):
+            slot = self.get_slot(index)
+            if slot is not None and slot[0] == key:
+                self.hits += 1
+                return ENTRY.unpack(slot[1].to_bytes(ENTRY.size, "little"))
+        self.misses += 1
+        return None
+
+    def insert(self, key, depth, bound, column, score):
+        # The key's own slot if it has one and this search went at least
+        # as deep, otherwise an empty slot or the bucket's shallowest
+        data = int.from_bytes(ENTRY.pack(depth, bound, column, score), "little")
+        first = (key % self.buckets) * BUCKET_SLOTS
+        target = None
+        target_depth = None
+        for index in range(first, first + BUCKET_SLOTS):
+            slot = self.get_slot(index)
+            if slot is None:
+                slot_depth = -1
+            elif slot[0] == key:
+                if slot[1] & 0xFF > depth:
+                    return
+                target = index
+                break
+            else:
+                slot_depth = slot[1] & 0xFF
+            if target is None or slot_depth < target_depth:
+                target, target_depth = index, slot_depth
+        self.write_slot(target, key, data)
+        self.stores += 1
+
+    def probe(self, board, evaluation, depth):
+        # (column, score) of a search of board to at least depth, or None
+        key, mirrored = self.get_key(board, evaluation)
+        entry = self.lookup(key)
+        if entry is None or entry[0] < depth or entry[1] != EXACT:
+            return None
+        column = entry[2]
+        if mirrored:
+            column = board.mirror_column(column)
+        return column, entry[3]
+
+    def store(self, board, evaluation, depth, score, column):
+        if self.read_only:
+            return
+        key, mirrored = self.get_key(board, evaluation)
+        if mirrored:
+            column = board.mirror_column(column)
+        self.insert(key, min(depth, 0xFF), EXACT, column, score)
+
+    def entries(self):
+        # Every readable (key, depth, bound, column, score) in the file
+        for index in range(self.slots):
+            slot = self.get_slot(index)
+            if slot is not None:
+                yield (slot[0], *ENTRY.unpack(slot[1].to_bytes(ENTRY.size, "little")))
+
+    def get_stats(self):
+        depths = {}
+        for entry in self.entries():
+            depths[entry[1]] = depths.get(entry[1], 0) + 1
+        lookups = self.hits + self.misses
+        return {
+            "slots": self.slots,
+            "used": sum(depths.values()),
+            "by_depth": dict(sorted(depths.items())),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+        }
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def create_cache(path, size_mb=DEFAULT_CACHE_MB):
+    # Builds the file under a temporary name and links it into place, so
+    # a process racing to create the same cache sees either nothing or a
+    # complete header
+    slots = max(size_mb * 2 ** 20 // SLOT.size // BUCKET_SLOTS, 1) * BUCKET_SLOTS
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as cache_file:
+        cache_file.write(HEADER.pack(CACHE_MAGIC, CACHE_VERSION, slots).ljust(HEADER_SIZE, b"\0"))
+        cache_file.truncate(HEADER_SIZE + slots * SLOT.size)
+    try:
+        os.link(temp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temp_path)
+
+
+# Caches opened by this process, so every engine in it shares one mapping
+open_caches = {}
+
+def get_cache(path, size_mb=DEFAULT_CACHE_MB):
+    if path not in open_caches:
+        open_caches[path] = AnalysisCache(path, size_mb)
+    return open_caches[path]
+
+
+def show_stats(args):
+    cache = AnalysisCache(args.cache, read_only=True)
+    stats = cache.get_stats()
+    cache.close()
+    print(f"{stats['used']} of {stats['slots']} slots used ({stats['used'] / stats['slots']:.1%})")
+    print("  ".join(f"depth {depth}: {count}" for depth, count in stats["by_depth"].items()))
+
+def merge(args):
+    # Folds other caches into this one, say from other machines, with
+    # the usual replacement deciding which entries stay
+    cache = AnalysisCache(args.cache, args.size)
+    for path in args.inputs:
+        source = AnalysisCache(path, read_only=True)
+        count = 0
+        for key, depth, bound, column, score in source.entries():
+            cache.insert(key, depth, bound, column, score)
+            count += 1
+        source.close()
+        print(f"Merged {count} entries from {path}")
+    cache.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inspect and merge analysis cache files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stats_parser = subparsers.add_parser("stats", help="Count the entries of a cache")
+    stats_parser.add_argument("cache", help="Cache file")
+    stats_parser.set_defaults(run=show_stats)
+
+    merge_parser = subparsers.add_parser("merge", help="Add the entries of other caches to one")
+    merge_parser.add_argument("cache", help="Cache to merge into, created if missing")
+    merge_parser.add_argument("inputs", nargs="+", help="Caches to read")
+    merge_parser.add_argument("--size", type=int, default=DEFAULT_CACHE_MB,
+                              help="Size in MB of the cache if it's created")
+    merge_parser.set_defaults(run=merge)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    try:
+        args.run(args)
+    except (OSError, ValueError) as error:
+        sys.exit(str(error))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Bulk analysis: searches a stream of positions, or the position before
+every move of recorded games, across a process pool and writes one JSON
+line per position in input order. Input is read and output written as
+the work goes, with only a few chunks per process in flight, so files of
+any length run in the same small amount of memory.
+
+Columns in the output (move, principal_variation, played) are 0-based,
+as in the solve command. Scores are all on the search's scale, and
+"source" says where the move came from: the cache, the solver or a
+search. Solved positions also carry their exact "result".
+"""
+
+
+
+import itertools
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from connect_four import Engine, SOLVER_SOURCE, format_moves, parse_moves
+from game_records import read_records
+
+
+
+# Chunks queued per process so workers never sit idle
+CHUNKS_PER_JOB = 4
+# Seconds between progress reports
+PROGRESS_SECONDS = 5.0
+
+
+
+def read_positions(args):
+    # Yields (height, width, win_length, moves, fields) for every line
+    # of the input, fields being what the output line starts with
+    if args.records:
+        for game, record in enumerate(read_records(args.input)):
+            for ply, column in enumerate(record.moves):
+                moves = record.moves[:ply]
+                fields = {"game": game, "ply": ply, "position": format_moves(moves, record.width),
+                          "played": column}
+                yield record.height, record.width, record.win_length, moves, fields
+        return
+    lines = open(args.input) if args.input else sys.stdin
+    try:
+        for line in lines:
+            position = line.strip()
+            if position:
+                yield args.height, args.width, args.connect, position, {"position": position}
+    finally:
+        if args.input:
+            lines.close()
+
+def get_chunks(positions, size):
+    while chunk := list(itertools.islice(positions, size)):
+        yield chunk
+
+
+# Each worker keeps an engine per kind of board so boards are only set
+# up once. Its table is cleared for every position: entries left by
+# other positions can break ties the other way, and results shouldn't
+# depend on which positions shared a process
+worker_engines = {}
+
+def get_engine(settings, height, width, win_length, moves):
+    _, _, evaluation, move_ordering, solver_cells, cache_path, tt_entries = settings
+    columns = parse_moves(moves, width)
+    key = (height, width, win_length)
+    engine = worker_engines.get(key)
+    if engine is None:
+        engine = Engine(height, width, win_length=win_length, evaluation=evaluation,
+                        move_ordering=move_ordering, solver_cells=solver_cells,
+                        tt_entries=tt_entries)
+        if cache_path is not None:
+            from analysis_cache import get_cache
+            engine.cache = get_cache(cache_path)
+        worker_engines[key] = engine
+    while engine.board.moves:
+        engine.undo()
+    engine.tt.clear()
+    for column in columns:
+        engine.play(column)
+    return engine
+
+def analyze_position(settings, height, width, win_length, moves):
+    depth, time_limit = settings[:2]
+    engine = get_engine(settings, height, width, win_length, moves)
+    if engine.check_game_over():
+        raise ValueError("The game is over")
+    static_score = engine.evaluate()
+    move = engine.best_move(depth=depth, time_limit=time_limit)
+    analysis = {
+        "move": move,
+        "score": engine.best_score,
+        "principal_variation": engine.principal_variation,
+        "static_score": static_score,
+        "nodes": engine.nodes,
+        "source": engine.move_source,
+    }
+    if engine.move_source == SOLVER_SOURCE:
+        score = engine.best_score
+        analysis["result"] = "win" if score > 0 else "loss" if score < 0 else "draw"
+    return analysis
+
+def analyze_chunk(settings, chunk):
+    results = []
+    for height, width, win_length, moves, fields in chunk:
+        result = dict(fields)
+        try:
+            result.update(analyze_position(settings, height, width, win_length, moves))
+        except ValueError as error:
+            result["error"] = str(error)
+        results.append(result)
+    return results
+
+def iterate_results(chunks, settings, jobs):
+    if jobs <= 1:
+        for chunk in chunks:
+            yield from analyze_chunk(settings, chunk)
+        return
+
+    # Chunks are collected in the order they went out, and no more than a
+    # few per process are ever pending, which bounds memory however far
+    # the oldest chunk holds the others up
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(analyze_chunk, settings, chunk))
+            if len(pending) >= jobs * CHUNKS_PER_JOB:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def report_progress(count, errors, start, out=sys.stderr):
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed else 0.0
+    print(f"{count} positions ({errors} errors) in {elapsed:.1f}s, {rate:.1f} positions/sec",
+          file=out, flush=True)
+
+def run_analyze(args):
+    if args.records and not args.input:
+        sys.exit("--records needs a record file to read")
+    settings = (args.depth, args.time, args.evaluation, args.move_ordering, args.solver_cells,
+                args.cache, args.tt_entries)
+    chunks = get_chunks(read_positions(args), args.chunk_size)
+    output = open(args.output, "w") if args.output else sys.stdout
+    count = 0
+    errors = 0
+    start = time.perf_counter()
+    next_report = start + PROGRESS_SECONDS
+
+    try:
+        for result in iterate_results(chunks, settings, args.jobs):
+            output.write(json.dumps(result) + "\n")
+            count += 1
+            errors += "error" in result
+            if time.perf_counter() >= next_report:
+                report_progress(count, errors, start)
+                next_report += PROGRESS_SECONDS
+    finally:
+        if args.output:
+            output.close()
+    report_progress(count, errors, start)
@@ -0,0 +1,181 @@
+"""
+Vectorized scoring of many positions at once with NumPy, for offline
+analysis and data generation.
+
+Positions are an (N, height, width) int8 array laid out like
+Board.board_spots (row 0 is the top): 0 for an empty cell, 1 for the
+first player's pieces and 2 for the second player's. Results match
+Engine.check_for_winner and Engine.evaluate for the same win length.
+"""
+
+
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from connect_four import (
+    RED_CIRCLE, YELLOW_CIRCLE, EMPTY_SPACE, FOUR, TWO_ROW_SCORE, THREE_ROW_SCORE, BLOCK_SCORE, WINNER_SCORE,
+    WINDOW_EVALUATION, LEGACY_EVALUATION, get_window_values,
+)
+
+
+
+EMPTY = 0
+FIRST = 1
+SECOND = 2
+CODES = {EMPTY_SPACE: EMPTY, RED_CIRCLE: FIRST, YELLOW_CIRCLE: SECOND}
+# Row and column steps of each line direction, in the order the
+# scalar checks run: horizontal, vertical, rising and falling diagonals
+DIRECTIONS = ((0, 1), (1, 0), (-1, 1), (1, 1))
+
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("Batch evaluation needs NumPy: pip install numpy")
+
+def encode_boards(boards, first_color=RED_CIRCLE):
+    # Stacks Board objects into the array layout used here
+    require_numpy()
+    codes = dict(CODES)
+    if first_color == YELLOW_CIRCLE:
+        codes[RED_CIRCLE], codes[YELLOW_CIRCLE] = SECOND, FIRST
+    return np.array(
+        [[[codes[cell] for cell in row] for row in board.board_spots] for board in boards],
+        dtype=np.int8,
+    )
+
+def get_window_slices(height, width, direction, length):
+    # For each offset along the line, the (rows, cols) slices picking that
+    # cell of every window of the given length, indexed by window start
+    step_row, step_col = direction
+    if step_row == 1:
+        rows = (0, height - length + 1)
+    elif step_row == -1:
+        rows = (length - 1, height)
+    else:
+        rows = (0, height)
+    cols = (0, width - length + 1) if step_col else (0, width)
+    return [
+        (slice(rows[0] + n * step_row, rows[1] + n * step_row),
+         slice(cols[0] + n * step_col, cols[1] + n * step_col))
+        for n in range(length)
+    ]
+
+def count_windows(pieces, direction, length):
+    # Pieces in every window of the given length, shape (N, starts...)
+    height, width = pieces.shape[1:]
+    slices = get_window_slices(height, width, direction, length)
+    counts = np.zeros((pieces.shape[0],) + pieces[(slice(None),) + slices[0]].shape[1:], np.int8)
+    for rows, cols in slices:
+        counts += pieces[:, rows, cols]
+    return counts
+
+def find_winners(positions, win_length=FOUR):
+    require_numpy()
+    wins = {}
+    for code in (FIRST, SECOND):
+        pieces = (positions == code).astype(np.int8)
+        found = np.zeros(positions.shape[0], dtype=bool)
+        for direction in DIRECTIONS:
+            counts = count_windows(pieces, direction, win_length)
+            found |= (counts == win_length).reshape(positions.shape[0], -1).any(axis=1)
+        wins[code] = found
+    # Like Board.check_winner the first player is reported if both have a line
+    winner = np.where(wins[FIRST], FIRST, np.where(wins[SECOND], SECOND, EMPTY)).astype(np.int8)
+    return wins[FIRST] | wins[SECOND], winner
+
+def get_playable(positions):
+    # Empty cells with a piece (or the floor) right under them
+    empty = positions == EMPTY
+    supported = np.ones_like(empty)
+    supported[:, :-1, :] = ~empty[:, 1:, :]
+    return empty & supported
+
+def count_playable_wins(positions, code, other, win_length=FOUR):
+    # Columns where a piece of code would complete a line
+    pieces = (positions == code).astype(np.int8)
+    blockers = (positions == other).astype(np.int8)
+    empty = positions == EMPTY
+    height, width = positions.shape[1:]
+    winning = np.zeros_like(empty)
+    for direction in DIRECTIONS:
+        almost = (count_windows(pieces, direction, win_length) == win_length - 1) & (
+            count_windows(blockers, direction, win_length) == 0)
+        for rows, cols in get_window_slices(height, width, direction, win_length):
+            winning[:, rows, cols] |= almost & empty[:, rows, cols]
+    return (winning & get_playable(positions)).reshape(positions.shape[0], -1).sum(axis=1)
+
+def get_window_scores(positions, code, other, win_length=FOUR):
+    pieces = (positions == code).astype(np.int8)
+    blockers = (positions == other).astype(np.int8)
+    values = np.array(get_window_values(win_length), dtype=np.int64)
+    scores = np.zeros(positions.shape[0], dtype=np.int64)
+    for direction in DIRECTIONS:
+        own = count_windows(pieces, direction, win_length)
+        open_windows = count_windows(blockers, direction, win_length) == 0
+        scores += (values[own] * open_windows).reshape(positions.shape[0], -1).sum(axis=1)
+    return scores
+
+def find_first_line(positions, direction, length):
+    # Which code the scalar check_* scan would report for this direction:
+    # the earliest full window in its scan order wins, first player first
+    count = positions.shape[0]
+    firsts = {}
+    for code in (FIRST, SECOND):
+        full = count_windows((positions == code).astype(np.int8), direction, length) == length
+        if direction == (1, 0):
+            # Vertical runs are scanned column by column
+            full = full.transpose(0, 2, 1)
+        elif direction == (-1, 1):
+            # Rising diagonals are scanned from the bottom row up
+            full = full[:, ::-1, :]
+        full = full.reshape(count, -1)
+        firsts[code] = np.where(full.any(axis=1), full.argmax(axis=1), full.shape[1])
+    found = np.minimum(firsts[FIRST], firsts[SECOND]) < full.shape[1]
+    return np.where(~found, EMPTY, np.where(firsts[FIRST] <= firsts[SECOND], FIRST, SECOND))
+
+def get_legacy_scores(positions, code, win_length=FOUR):
+    scores = np.zeros(positions.shape[0], dtype=np.int64)
+    for length, value in ((win_length - 1, THREE_ROW_SCORE), (win_length - 2, TWO_ROW_SCORE)):
+        for direction in DIRECTIONS:
+            line = find_first_line(positions, direction, length)
+            scores += np.where(line == code, value, np.where(line != EMPTY, -value, 0))
+    return scores
+
+def get_side_to_move(positions):
+    first = (positions == FIRST).reshape(positions.shape[0], -1).sum(axis=1)
+    second = (positions == SECOND).reshape(positions.shape[0], -1).sum(axis=1)
+    return np.where(first == second, FIRST, SECOND).astype(np.int8)
+
+def evaluate_batch(positions, perspective=None, evaluation=WINDOW_EVALUATION, win_length=FOUR):
+    # Returns (win flags, winner codes, scores). Scores are for the code
+    # in perspective (a scalar or one per position, defaulting to the
+    # side to move) and follow Engine.evaluate: +/-WINNER_SCORE for a
+    # finished game, 0 for a full board, otherwise the heuristic
+    require_numpy()
+    positions = np.asarray(positions, dtype=np.int8)
+    if positions.ndim == 2:
+        positions = positions[np.newaxis]
+    if perspective is None:
+        perspective = get_side_to_move(positions)
+    perspective = np.broadcast_to(np.asarray(perspective, dtype=np.int8), positions.shape[:1])
+
+    win, winner = find_winners(positions, win_length)
+    scores = {}
+    for code, other in ((FIRST, SECOND), (SECOND, FIRST)):
+        if evaluation == LEGACY_EVALUATION:
+            score = get_legacy_scores(positions, code, win_length)
+        else:
+            score = (get_window_scores(positions, code, other, win_length)
+                     - get_window_scores(positions, other, code, win_length))
+        score -= BLOCK_SCORE * count_playable_wins(positions, other, code, win_length)
+        scores[code] = score
+    heuristic = np.where(perspective == FIRST, scores[FIRST], scores[SECOND])
+
+    full = ~(positions == EMPTY).reshape(positions.shape[0], -1).any(axis=1)
+    score = np.where(win, np.where(winner == perspective, WINNER_SCORE, -WINNER_SCORE),
+                     np.where(full, 0, heuristic))
+    return win, winner, score
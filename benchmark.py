@@ -0,0 +1,183 @@
+"""
+Benchmarks for the search and evaluation hot paths over a fixed corpus
+of positions. Results can be saved as a baseline and later runs compared
+against it, failing when any metric regresses past a threshold.
+"""
+
+
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from connect_four import Engine
+
+
+
+# (name, height, width, moves, search depth)
+CORPUS = [
+    ("opening", 6, 7, "", 7),
+    ("early", 6, 7, "5144512474", 7),
+    ("midgame", 6, 7, "66772366717352144112", 8),
+    ("late", 6, 7, "27653463417715721156265734214326", 10),
+    ("near_terminal", 6, 7, "377424215467253246536521544236537613", 12),
+    ("wide_opening", 9, 10, "", 5),
+    ("wide_midgame", 9, 10, "1,9,4,1,2,3,10,9,7,6,9,2,7,1,4,10,5,7,10,2,5,9,2,10,8,5,3,5,5,5", 6),
+    ("large_opening", 12, 15, "", 4),
+    ("large_early", 12, 15, "15,12,11,13,13,15,15,3,5,11,11,14,15,2,14,6,10,15,3,1", 4),
+    ("large_midgame", 12, 15,
+     "6,3,10,12,6,14,15,9,4,7,1,13,2,14,10,1,15,2,4,3,1,6,3,3,9,4,14,8,6,7,1,10,2,15,13,"
+     "15,4,8,14,8,10,3,9,15,15,12,12,7,3,3,15,15,14,9,8,13,7,12,3,7", 5),
+]
+# Calls timed for each of the cheap per-position functions
+EVALUATION_CALLS = 20000
+WINNER_CALLS = 20000
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10
+# Metrics where a larger number is an improvement; all others should shrink
+HIGHER_IS_BETTER = {"nodes_per_sec", "evaluations_per_sec", "winner_checks_per_sec"}
+# Searches quicker than this are too noisy to compare
+MIN_COMPARED_SECONDS = 0.01
+# The late positions are within the solver's reach, which would answer
+# them without searching; the benchmark is of the search itself
+BENCHMARK_SOLVER_CELLS = 0
+
+
+
+def time_calls(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return calls / (time.perf_counter() - start)
+
+def run_search(height, width, moves, depth):
+    engine = Engine(height, width, moves, solver_cells=BENCHMARK_SOLVER_CELLS)
+    start = time.perf_counter()
+    move = engine.best_move(depth=depth)
+    return move, engine.nodes, time.perf_counter() - start
+
+def measure_peak_memory(height, width, moves, depth):
+    # Kept apart from the timed runs since tracing slows everything down
+    tracemalloc.start()
+    run_search(height, width, moves, depth)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def benchmark_position(height, width, moves, depth, repeat):
+    # Each timing is the best of several runs on a fresh engine
+    engine = Engine(height, width, moves, solver_cells=BENCHMARK_SOLVER_CELLS)
+    engine.set_side(engine.get_color_to_move())
+    metrics = {
+        "evaluations_per_sec": max(
+            time_calls(engine.evaluation_function, EVALUATION_CALLS) for _ in range(repeat)
+        ),
+        "winner_checks_per_sec": max(
+            time_calls(engine.check_for_winner, WINNER_CALLS) for _ in range(repeat)
+        ),
+    }
+
+    time_to_depth = {}
+    for target in range(1, depth + 1):
+        time_to_depth[str(target)] = min(
+            run_search(height, width, moves, target)[2] for _ in range(repeat)
+        )
+    move, nodes, _ = run_search(height, width, moves, depth)
+    seconds = time_to_depth[str(depth)]
+    metrics["move"] = move
+    metrics["nodes"] = nodes
+    metrics["search_seconds"] = seconds
+    metrics["nodes_per_sec"] = nodes / seconds
+    metrics["time_to_depth"] = time_to_depth
+    metrics["peak_memory_bytes"] = measure_peak_memory(height, width, moves, depth)
+    return metrics
+
+def run_benchmarks(names=None, repeat=DEFAULT_REPEAT, out=sys.stdout):
+    results = {}
+    for name, height, width, moves, depth in CORPUS:
+        if names and name not in names:
+            continue
+        metrics = benchmark_position(height, width, moves, depth, repeat)
+        metrics["board"] = f"{height}x{width}"
+        metrics["depth"] = depth
+        results[name] = metrics
+        print(
+            f"{name:15} {height}x{width:<3} depth {depth:2}  "
+            f"{metrics['nodes']:8} nodes  {metrics['search_seconds']:7.3f}s  "
+            f"{metrics['nodes_per_sec']:9.0f} nodes/s  "
+            f"{metrics['evaluations_per_sec']:9.0f} evals/s  "
+            f"{metrics['winner_checks_per_sec']:9.0f} wins/s  "
+            f"{metrics['peak_memory_bytes'] / 1024:8.0f} KiB",
+            file=out,
+        )
+    return results
+
+def get_comparable_metrics(metrics):
+    values = {
+        key: value for key, value in metrics.items()
+        if isinstance(value, (int, float)) and key not in ("move", "depth")
+    }
+    for depth, seconds in metrics.get("time_to_depth", {}).items():
+        if seconds >= MIN_COMPARED_SECONDS:
+            values[f"time_to_depth_{depth}"] = seconds
+    if values.get("search_seconds", 0) < MIN_COMPARED_SECONDS:
+        values.pop("search_seconds", None)
+        values.pop("nodes_per_sec", None)
+    return values
+
+def compare_results(results, baseline, threshold):
+    # Returns a line for every metric that got worse by more than threshold
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        current = get_comparable_metrics(metrics)
+        previous = get_comparable_metrics(baseline[name])
+        for key, value in current.items():
+            old = previous.get(key)
+            if not old:
+                continue
+            if key in HIGHER_IS_BETTER:
+                change = (old - value) / old
+            else:
+                change = (value - old) / old
+            if change > threshold:
+                regressions.append(f"{name}: {key} {old:.6g} -> {value:.6g} ({change:+.1%} worse)")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark search and evaluation")
+    parser.add_argument("--positions", nargs="*", help="Only run these corpus positions")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="Runs per timing, the best one is kept")
+    parser.add_argument("--save", help="Write the results to this baseline file")
+    parser.add_argument("--compare", help="Baseline file to check the results against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown before a metric counts as a regression")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    results = run_benchmarks(args.positions, args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,11 @@ Date: 2024-10-21
 import random
 from math import inf
 import argparse
+import time
+import json
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 
 
@@ -19,42 +24,361 @@ RED_CIRCLE = "\U0001f534"
 YELLOW_CIRCLE = "\U0001F7E1"
 POINTER = "↓"
 FOUR = 4
-THREE = 3
-TWO = 2
 TWO_ROW_SCORE = 100
 THREE_ROW_SCORE = 250
 BLOCK_SCORE = 300
 WINNER_SCORE = 1000
+# Points a win is worth less for every ply it takes to get there
+WIN_PLY_PENALTY = 5
+# Further from zero than any score, so it can stand in for infinity in
+# the search's integer windows
+SEARCH_BOUND = 1 << 30
+# Scores for a window (a run of cells a line can be made in) holding
+# only one player's pieces, two and one short of a full line
+WINDOW_TWO_SCORE = 5
+WINDOW_THREE_SCORE = 20
+# Shortest line the game can be played to win with
+MIN_WIN_LENGTH = 3
+WINDOW_EVALUATION = "windows"
+LEGACY_EVALUATION = "legacy"
 # Length of longer line in instructions
 SPACE_OVER = 44
 COLUMN_WIDTH = 6
 DOUBLE_DIGIT_INT = 10
 EMPTY_SPACE = " "
+UNDERLINE = "\033[4m"
+RESET_STYLE = "\033[0m"
+CLEAR_SCREEN = "\033[H\033[2J"
+# How the board is drawn: the whole frame every move, or only what
+# changed, with ANSI cursor movement
+FULL_RENDERING = "full"
+DIFF_RENDERING = "diff"
+OPPONENT = {RED_CIRCLE: YELLOW_CIRCLE, YELLOW_CIRCLE: RED_CIRCLE}
 
 MAX_DEPTH = 3
+# Half-width of the window each iteration starts with around the
+# previous iteration's score
+ASPIRATION_WINDOW = 50
+# How many nodes to search between clock checks
+TIME_CHECK_NODES = 128
 
+# Move ordering inside the search
+HEURISTIC_ORDERING = "heuristic"
+CENTER_ORDERING = "center"
+KILLER_SLOTS = 2
+
+# Positions with this many empty cells or fewer are solved exactly
+SOLVER_EMPTY_CELLS = 12
+
+# Where a move picked by find_best_move came from
+BOOK_SOURCE = "book"
+CACHE_SOURCE = "cache"
+SOLVER_SOURCE = "solver"
+SEARCH_SOURCE = "search"
+PONDER_SOURCE = "ponder"
+
+# Transposition table settings
+TT_MAX_ENTRIES = 1 << 18
+ZOBRIST_SEED = 20241021
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+
+
+def get_window_values(win_length):
+    # Score of a window by how many of one player's pieces it holds:
+    # WINDOW_TWO_SCORE two short of a line, WINDOW_THREE_SCORE one short
+    values = [0] * (win_length + 1)
+    values[win_length - 1] = WINDOW_THREE_SCORE
+    values[win_length - 2] = WINDOW_TWO_SCORE
+    return values
 
 
 class Board:
-    def __init__(self, height, width):
+    def __init__(self, height, width, win_length=FOUR, rendering=FULL_RENDERING):
         self.height = height
         self.width = width
+        self.win_length = win_length
         self.spacing = self.get_spacing()
-        self.board_spots = [
-            [EMPTY_SPACE for _ in range(self.width)] for _ in range(self.height)
+        self.rendering = rendering
+        # What the last frame drawn in diff rendering showed, and the
+        # terminal rows printed under it since
+        self.drawn_spots = None
+        self.lines_below = 0
+        # Pieces are stored column by column, one bit per cell counted
+        # from the bottom, with an extra sentinel bit on top of each
+        # column so shifted masks never wrap into the next column
+        self.column_bits = self.height + 1
+        self.bitboards = {RED_CIRCLE: 0, YELLOW_CIRCLE: 0}
+        self.occupied = 0
+        self.heights = [0] * self.width
+        self.bottom_mask = 0
+        for col in range(self.width):
+            self.bottom_mask |= 1 << (col * self.column_bits)
+        self.board_mask = self.bottom_mask * ((1 << self.height) - 1)
+        # Every cell of each column, and the columns in the order searches
+        # try them
+        self.column_masks = [
+            ((1 << self.height) - 1) << (col * self.column_bits) for col in range(self.width)
         ]
+        self.center_columns = self.get_center_columns()
+        # Bit distances to the neighbouring cell in each direction:
+        # vertical, horizontal, falling and rising diagonals
+        self.shifts = (1, self.column_bits, self.column_bits - 1, self.column_bits + 1)
+        self.moves = []
+        self.init_zobrist()
+        self.init_windows()
+        # Line masks used by the legacy scans, by line length
+        self.scan_lines = {}
+
+    def init_zobrist(self):
+        # Random keys are seeded so every process and every new board of
+        # the same size hashes a position to the same value
+        rng = random.Random(ZOBRIST_SEED)
+        cells = self.width * self.column_bits
+        self.zobrist = {
+            color: [rng.getrandbits(64) for _ in range(cells)] for color in self.bitboards
+        }
+        self.zobrist_side = {color: rng.getrandbits(64) for color in self.bitboards}
+        self.hash = 0
+        # Hash of the position reflected left to right, kept alongside so
+        # a position and its mirror image can share one key
+        self.mirror_hash = 0
+
+    def init_windows(self):
+        # Every run of win_length cells a line can be made in, and for
+        # every cell the windows running through it. Built once per board
+        # and used for both evaluation and spotting wins
+        length = self.win_length
+        self.window_values = get_window_values(length)
+        self.windows = []
+        self.cell_windows = [[] for _ in range(self.width * self.column_bits)]
+        for step_col, step_level in ((0, 1), (1, 0), (1, -1), (1, 1)):
+            for col in range(self.width):
+                for level in range(self.height):
+                    end_col = col + step_col * (length - 1)
+                    end_level = level + step_level * (length - 1)
+                    if end_col >= self.width or not 0 <= end_level < self.height:
+                        continue
+                    window = len(self.windows)
+                    cells = []
+                    for n in range(length):
+                        index = (col + step_col * n) * self.column_bits + level + step_level * n
+                        cells.append(index)
+                        self.cell_windows[index].append(window)
+                    self.windows.append(tuple(cells))
+        # Piece counts per window and the running window score of each color
+        self.window_counts = {color: [0] * len(self.windows) for color in self.bitboards}
+        self.window_scores = {color: 0 for color in self.bitboards}
+
+    def add_to_windows(self, index, color):
+        values = self.window_values
+        own_counts = self.window_counts[color]
+        other_counts = self.window_counts[OPPONENT[color]]
+        own_score = 0
+        other_score = 0
+        for window in self.cell_windows[index]:
+            own = own_counts[window]
+            other = other_counts[window]
+            if other == 0:
+                own_score += values[own + 1] - values[own]
+            elif own == 0:
+                # The window is now blocked for the other color
+                other_score -= values[other]
+            own_counts[window] = own + 1
+        self.window_scores[color] += own_score
+        self.window_scores[OPPONENT[color]] += other_score
+
+    def remove_from_windows(self, index, color):
+        values = self.window_values
+        own_counts = self.window_counts[color]
+        other_counts = self.window_counts[OPPONENT[color]]
+        own_score = 0
+        other_score = 0
+        for window in self.cell_windows[index]:
+            own = own_counts[window] - 1
+            other = other_counts[window]
+            if other == 0:
+                own_score -= values[own + 1] - values[own]
+            elif own == 0:
+                other_score += values[other]
+            own_counts[window] = own
+        self.window_scores[color] += own_score
+        self.window_scores[OPPONENT[color]] += other_score
+
+    def get_scan_lines(self, length):
+        # Masks of every line of the given length for each direction of
+        # the legacy scans, kept in the order those scans visit them:
+        # rows top to bottom, columns top down, rising diagonals from the
+        # bottom row up and falling ones from the top
+        if length not in self.scan_lines:
+            def get_mask(cells):
+                mask = 0
+                for row, col in cells:
+                    mask |= self.get_bit(col, self.height - 1 - row)
+                return mask
+
+            n_cells = range(length)
+            self.scan_lines[length] = {
+                "horizontal": [
+                    get_mask((row, col - n) for n in n_cells)
+                    for row in range(self.height) for col in range(length - 1, self.width)
+                ],
+                "vertical": [
+                    get_mask((row - n, col) for n in n_cells)
+                    for col in range(self.width) for row in range(length - 1, self.height)
+                ],
+                "rising": [
+                    get_mask((row - n, col + n) for n in n_cells)
+                    for row in range(self.height - 1, length - 2, -1)
+                    for col in range(self.width - length + 1)
+                ],
+                "falling": [
+                    get_mask((row + n, col + n) for n in n_cells)
+                    for row in range(self.height - length + 1)
+                    for col in range(self.width - length + 1)
+                ],
+            }
+        return self.scan_lines[length]
+
+    def get_key(self, color_to_move):
+        return self.hash ^ self.zobrist_side[color_to_move]
+
+    def get_canonical_key(self, color_to_move):
+        # The same key for a position and its mirror image, and whether
+        # this position is the mirrored one (its moves then need flipping
+        # with mirror_column to match what was stored under the key)
+        if self.mirror_hash < self.hash:
+            return self.mirror_hash ^ self.zobrist_side[color_to_move], True
+        return self.hash ^ self.zobrist_side[color_to_move], False
+
+    def mirror_column(self, column):
+        return self.width - 1 - column
+
+    def is_symmetric(self):
+        return self.hash == self.mirror_hash
+
+    @property
+    def board_spots(self):
+        # Grid view of the bitboards (row 0 is the top row) for rendering
+        spots = [[EMPTY_SPACE for _ in range(self.width)] for _ in range(self.height)]
+        for col in range(self.width):
+            for level in range(self.heights[col]):
+                spots[self.height - 1 - level][col] = self.get_color(col, level)
+        return spots
+
+    def get_bit(self, column, level):
+        return 1 << (column * self.column_bits + level)
+
+    def get_color(self, column, level):
+        bit = self.get_bit(column, level)
+        for color, bitboard in self.bitboards.items():
+            if bitboard & bit:
+                return color
+        return EMPTY_SPACE
 
     def update_board(self, column, player):
-        for row in range(self.height - 1, -1, -1):
-            if self.board_spots[row][column] == EMPTY_SPACE:
-                self.board_spots[row][column] = player.color
-                return
-            
+        if self.heights[column] == self.height:
+            return
+        index = column * self.column_bits + self.heights[column]
+        bit = 1 << index
+        self.bitboards[player.color] |= bit
+        self.occupied |= bit
+        self.hash ^= self.zobrist[player.color][index]
+        self.mirror_hash ^= self.zobrist[player.color][
+            (self.width - 1 - column) * self.column_bits + self.heights[column]]
+        self.add_to_windows(index, player.color)
+        self.heights[column] += 1
+        self.moves.append(column)
+
     def undo_update(self, column):
-        for row in range(self.height):
-            if self.board_spots[row][column] != EMPTY_SPACE:
-                self.board_spots[row][column] = EMPTY_SPACE
-                return
+        if self.heights[column] == 0:
+            return
+        self.heights[column] -= 1
+        index = column * self.column_bits + self.heights[column]
+        bit = 1 << index
+        for color in self.bitboards:
+            if self.bitboards[color] & bit:
+                self.bitboards[color] &= ~bit
+                self.hash ^= self.zobrist[color][index]
+                self.mirror_hash ^= self.zobrist[color][
+                    (self.width - 1 - column) * self.column_bits + self.heights[column]]
+                self.remove_from_windows(index, color)
+        self.occupied &= ~bit
+        # Moves are normally undone in reverse order, but any column's
+        # top piece can be lifted so drop its latest entry
+        for index in range(len(self.moves) - 1, -1, -1):
+            if self.moves[index] == column:
+                del self.moves[index]
+                break
+
+    def is_winning_mask(self, bitboard, in_a_row=None):
+        if in_a_row is None:
+            in_a_row = self.win_length
+        for shift in self.shifts:
+            line = bitboard
+            for _ in range(in_a_row - 1):
+                line &= line >> shift
+            if line:
+                return True
+        return False
+
+    def get_winning_cells(self, color):
+        return self.find_winning_cells(self.bitboards[color], self.occupied)
+
+    def find_winning_cells(self, pieces, occupied):
+        # Empty cells that would complete a line for pieces
+        if self.win_length == FOUR:
+            # Unrolled for the usual game, it's on the hot path of the search
+            cells = (pieces << 1) & (pieces << 2) & (pieces << 3)
+            for shift in self.shifts[1:]:
+                pair = (pieces << shift) & (pieces << 2 * shift)
+                cells |= pair & (pieces << 3 * shift)
+                cells |= pair & (pieces >> shift)
+                pair = (pieces >> shift) & (pieces >> 2 * shift)
+                cells |= pair & (pieces << shift)
+                cells |= pair & (pieces >> 3 * shift)
+            return cells & (self.board_mask ^ occupied)
+
+        # Any other length: cells with n pieces in a row on one side and
+        # the rest of the line on the other
+        needed = self.win_length - 1
+        # Vertical lines can only be finished from the top
+        cells = pieces << 1
+        for n in range(2, needed + 1):
+            cells &= pieces << n
+        for shift in self.shifts[1:]:
+            # before[n] / after[n]: cells with n pieces in a row right
+            # behind / ahead of them in this direction (-1 is all ones)
+            before = [-1]
+            after = [-1]
+            for n in range(1, needed + 1):
+                before.append(before[-1] & (pieces << n * shift))
+                after.append(after[-1] & (pieces >> n * shift))
+            for n in range(needed + 1):
+                cells |= before[n] & after[needed - n]
+        return cells & (self.board_mask ^ occupied)
+
+    def check_winner(self):
+        for color, bitboard in self.bitboards.items():
+            if self.is_winning_mask(bitboard):
+                return True, color
+        return False, None
+
+    def check_last_move(self):
+        # Only the player who just dropped a piece can have a new line,
+        # and only in a window through that piece
+        if not self.moves:
+            return False, None
+        column = self.moves[-1]
+        level = self.heights[column] - 1
+        color = self.get_color(column, level)
+        counts = self.window_counts[color]
+        for window in self.cell_windows[column * self.column_bits + level]:
+            if counts[window] == self.win_length:
+                return True, color
+        return False, None
 
     def get_spacing(self):
         # Setting a space buffer to center the board on the instructions
@@ -63,81 +387,442 @@ class Board:
             spacing = 0
         return spacing
     
-    def print_board_bottom(self):
-        print(" " * self.spacing, end="")
+    def render_board_bottom(self):
+        labels = [" " * self.spacing]
         if self.width >= DOUBLE_DIGIT_INT:
             for num in range(1, DOUBLE_DIGIT_INT):
-                print(f"  [{num}] ", end="")
+                labels.append(f"  [{num}] ")
             for num in range(DOUBLE_DIGIT_INT, self.width + 1):
-                print(f" [{num}]", end=" ")
+                labels.append(f" [{num}] ")
         else:
             for num in range(1, self.width + 1):
-                print(f"  [{num}] ", end="")
+                labels.append(f"  [{num}] ")
         # Give space for next line
-        print("\n")
-
+        labels.append("\n\n")
+        return "".join(labels)
+
+    def render_chosen_row(self, column):
+        cells = [f"   {POINTER}  " if col == column else "      " for col in range(self.width)]
+        return " " * self.spacing + "".join(cells) + "\n"
+
+    def render_cell(self, spot, row):
+        # The cell's left wall and contents, underlined on the bottom row
+        cell = "|     " if spot == EMPTY_SPACE else f"| {spot}  "
+        if row == self.height - 1:
+            return UNDERLINE + cell + RESET_STYLE
+        return cell
+
+    def render_rows(self, spots):
+        lines = []
+        for row in range(self.height):
+            wall = "|" if row < self.height - 1 else UNDERLINE + "|" + RESET_STYLE
+            cells = "".join(self.render_cell(spot, row) for spot in spots[row])
+            lines.append(" " * self.spacing + cells + wall + "\n")
+        return "".join(lines)
 
-    def print_default_board(self):
+    def render_default_board(self):
+        # The empty board as one string, for printing or logging
         self.spacing = self.get_spacing()
-        
-        for _ in range(self.height - 1):
-            print(" " * self.spacing, end="")
-            for _ in range(self.width):
-                print("|     ", end="")
-            print("|")
+        empty = [[EMPTY_SPACE] * self.width for _ in range(self.height)]
+        return self.render_rows(empty) + self.render_board_bottom()
+
+    def render_current_board(self, column):
+        # The board with the pointer over column as one string
+        return ("\n" + self.render_chosen_row(column) + self.render_rows(self.board_spots)
+                + self.render_board_bottom())
+
+    def render_changes(self, column):
+        # ANSI codes redrawing only the cells that changed since the last
+        # frame and the pointer row, then clearing everything below the
+        # board. Frames are drawn from the top of the screen, the pointer
+        # row on line 2 and the top row of cells on line 3
+        spots = self.board_spots
+        codes = [f"\033[2;1H\033[2K{self.render_chosen_row(column)}"]
+        for row in range(self.height):
+            for col in range(self.width):
+                if spots[row][col] != self.drawn_spots[row][col]:
+                    x = self.spacing + col * COLUMN_WIDTH + 1
+                    codes.append(f"\033[{row + 3};{x}H{self.render_cell(spots[row][col], row)}")
+        codes.append(f"\033[{self.height + 5};1H\033[J")
+        self.drawn_spots = spots
+        return "".join(codes)
+
+    def count_lines_below(self, text):
+        # Keeps track of how far text written under the board has moved
+        # the cursor, counting lines the terminal wraps
+        columns = shutil.get_terminal_size().columns
+        for line in text.split("\n")[:-1]:
+            self.lines_below += len(line) // columns + 1
+
+    def has_scrolled(self):
+        # Whether the output under the last frame may have scrolled it up
+        # the screen, which would leave the absolute cursor positions of
+        # render_changes pointing at the wrong rows
+        room = shutil.get_terminal_size().lines - (self.height + 5)
+        return self.lines_below > room
+
+    def write(self, text):
+        # One write per frame, so the terminal never shows half of one
+        sys.stdout.write(text)
+        sys.stdout.flush()
 
-        # Prints last line ("underline")
-        print(" " * self.spacing, end="")
-        print("\033[4m|     \033[0m" * self.width, end="\033[4m|\033[0m\n")
+    def print_board_bottom(self):
+        self.write(self.render_board_bottom())
 
-        self.print_board_bottom()
+    def print_default_board(self):
+        if self.rendering == DIFF_RENDERING:
+            # Later frames only patch this one, so it starts the screen
+            self.spacing = self.get_spacing()
+            self.drawn_spots = [[EMPTY_SPACE] * self.width for _ in range(self.height)]
+            self.lines_below = 0
+            self.write(CLEAR_SCREEN + self.render_current_board(None))
+        else:
+            self.write(self.render_default_board())
 
     def print_chosen_row(self, column):
-        print(" " * self.spacing, end="")
-        for col in range(self.width):
-            if col == column:
-                print(f"   {POINTER}  ", end="")
-            else:
-                print("      ", end="")
-        print()
+        self.write(self.render_chosen_row(column))
 
     def print_current_board(self, column):
-        print()
-        self.print_chosen_row(column)
-        for row in range(self.height - 1):
-            print(" " * self.spacing, end="")
-            for col in range(self.width):
-                if self.board_spots[row][col] == EMPTY_SPACE:
-                    print(f"|     ", end="")
-                else:
-                    print(f"| {self.board_spots[row][col]}  ", end="")
-            print("|")
-
-        print(" " * self.spacing, end="")
-        for col in range(len(self.board_spots[self.height - 1])):
-            if self.board_spots[self.height - 1][col] == EMPTY_SPACE:
-                print(f"\033[4m|     \033[0m", end="")
-            else:
-                print(f"\033[4m| {self.board_spots[self.height - 1][col]}  \033[0m", end="")
-        print("\033[4m|\033[0m\n", end="")
-        
-        self.print_board_bottom()
+        if self.rendering != DIFF_RENDERING:
+            self.write(self.render_current_board(column))
+        elif self.drawn_spots is None or self.has_scrolled():
+            # Starts again from a cleared screen the next patches can rely on
+            self.drawn_spots = self.board_spots
+            self.write(CLEAR_SCREEN + self.render_current_board(column))
+        else:
+            self.write(self.render_changes(column))
+        self.lines_below = 0
 
     def print_board_size(self):
         if self.height != DEFAULT_HEIGHT or self.width != DEFAULT_WIDTH:
             string_length = len(f"Starting the game with a board of {self.height}x{self.width}")
             spacing = (((self.width * COLUMN_WIDTH) + 1) - string_length) // 2
-            print(" " * spacing, end=f"Starting the game with a board of {self.height}x{self.width}\n\n")
+            text = " " * spacing + f"Starting the game with a board of {self.height}x{self.width}\n\n"
+            self.write(text)
+            self.count_lines_below(text)
 
     def get_empty_columns(self):
-        empty_columns = []
-        for col in range(len(self.board_spots[0])):
-            if self.board_spots[0][col] == EMPTY_SPACE:
-                empty_columns.append(col)
-        return empty_columns
-    
+        return [col for col in range(self.width) if self.heights[col] < self.height]
+
+    def get_center_columns(self):
+        # Sets up an alternating move checker
+        # prioritizing middle of the board and
+        # moving outwards from there
+        middle = self.width // 2
+        columns = [middle]
+        for n in range(1, middle + 1):
+            if middle + n < self.width:
+                columns.append(middle + n)
+            if middle - n >= 0:
+                columns.append(middle - n)
+        return columns
+
+    def get_possible(self, mask):
+        # One bit set at the next free cell of every column that isn't
+        # full, for any mask of occupied cells laid out like this board's
+        return (mask + self.bottom_mask) & self.board_mask
+
+    def get_legal_mask(self):
+        return self.get_possible(self.occupied)
+
+    def is_column_open(self, column):
+        return self.heights[column] < self.height
+
     def is_board_full(self):
-        return all(all(col is not EMPTY_SPACE for col in row) for row in self.board_spots)
+        return self.occupied == self.board_mask
+
+class SearchTimeout(Exception):
+    pass
+
+class SearchStats:
+    # Optional record of what a search did. The search only touches it
+    # when one is attached, so it costs nothing when turned off
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.nodes_by_depth = {}
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        # Null-window and aspiration searches that had to be repeated
+        self.researches = 0
+        self.aspiration_researches = 0
+        # Calls and seconds spent in each timed step
+        self.timers = {"check_for_winner": [0, 0.0], "is_board_full": [0, 0.0],
+                       "evaluation_function": [0, 0.0]}
+        self.iterations = []
+        self.tt_hits = 0
+        self.tt_misses = 0
+        self.seconds = 0.0
+        # BOOK_SOURCE, CACHE_SOURCE or SOLVER_SOURCE if the move was found
+        # without searching, SEARCH_SOURCE otherwise
+        self.source = None
+
+    def count_node(self, depth):
+        self.nodes_by_depth[depth] = self.nodes_by_depth.get(depth, 0) + 1
+
+    def count_cutoff(self, moves_searched):
+        self.cutoffs += 1
+        if moves_searched == 1:
+            self.first_move_cutoffs += 1
+
+    def time_call(self, name, function):
+        start = time.perf_counter()
+        result = function()
+        timer = self.timers[name]
+        timer[0] += 1
+        timer[1] += time.perf_counter() - start
+        return result
+
+    def merge(self, other):
+        # Adds in the counts of a search run in another process
+        for depth, nodes in other["nodes_by_depth"].items():
+            depth = int(depth)
+            self.nodes_by_depth[depth] = self.nodes_by_depth.get(depth, 0) + nodes
+        self.cutoffs += other["cutoffs"]
+        self.first_move_cutoffs += other["first_move_cutoffs"]
+        self.researches += other["researches"]
+        self.aspiration_researches += other["aspiration_researches"]
+        for name, (calls, seconds) in other["timers"].items():
+            self.timers[name][0] += calls
+            self.timers[name][1] += seconds
+
+    def get_branching_factor(self):
+        # Growth in nodes between the last two finished iterations
+        if len(self.iterations) < 2 or not self.iterations[-2]["nodes"]:
+            return None
+        return self.iterations[-1]["nodes"] / self.iterations[-2]["nodes"]
+
+    def as_dict(self):
+        lookups = self.tt_hits + self.tt_misses
+        return {
+            "nodes": sum(self.nodes_by_depth.values()),
+            "nodes_by_depth": dict(sorted(self.nodes_by_depth.items())),
+            "cutoffs": self.cutoffs,
+            "first_move_cutoffs": self.first_move_cutoffs,
+            "first_move_cutoff_rate": self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0,
+            "researches": self.researches,
+            "aspiration_researches": self.aspiration_researches,
+            "effective_branching_factor": self.get_branching_factor(),
+            "timers": {name: list(timer) for name, timer in self.timers.items()},
+            "iterations": self.iterations,
+            "tt_hits": self.tt_hits,
+            "tt_misses": self.tt_misses,
+            "tt_hit_rate": self.tt_hits / lookups if lookups else 0.0,
+            "seconds": self.seconds,
+            "source": self.source,
+        }
+
+    def dump(self, path):
+        with open(path, "a") as stats_file:
+            stats_file.write(json.dumps(self.as_dict()) + "\n")
+
+class TranspositionTable:
+    def __init__(self, max_entries=TT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = [None] * max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # Bumped by clear(), entries stored before that no longer match
+        self.generation = 0
+
+    # Entries are (key, depth, flag, score, move, root_ply, generation).
+    # Scores are relative to the ply count of the search root, so root_ply
+    # tells whether a stored score can be reused by the current search
+    def lookup(self, key):
+        entry = self.entries[key % self.max_entries]
+        if entry is not None and entry[0] == key and entry[6] == self.generation:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, flag, score, move, root_ply):
+        index = key % self.max_entries
+        entry = self.entries[index]
+        if entry is not None and entry[0] != key and entry[6] == self.generation:
+            # Keep a deeper result from the current search, otherwise
+            # replace whatever is in the slot
+            if entry[5] == root_ply and entry[1] > depth:
+                return
+            self.evictions += 1
+        self.entries[index] = (key, depth, flag, score, move, root_ply, self.generation)
+        self.stores += 1
+
+    def clear(self):
+        # Instead of reallocating the slots, which costs as much as the
+        # whole search of an easy position
+        self.generation += 1
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "used": sum(1 for entry in self.entries if entry is not None and entry[6] == self.generation),
+            "max_entries": self.max_entries,
+        }
+
+class Solver:
+    # Exact search to the end of the game with null-window negamax over
+    # raw bitboards (current = pieces of the side to move, mask = all
+    # pieces). Scores are positive when the side to move wins, larger the
+    # sooner it wins, negative when it loses and 0 for a draw
+    def __init__(self, height, width, win_length=FOUR, max_entries=TT_MAX_ENTRIES):
+        self.layout = Board(height, width, win_length)
+        self.size = height * width
+        self.tt = TranspositionTable(max_entries)
+        self.column_masks = self.layout.column_masks
+        self.column_order = self.layout.center_columns
+        self.nodes = 0
+        self.deadline = None
+        self.next_check = inf
+
+    def set_deadline(self, deadline):
+        self.deadline = deadline
+        self.next_check = inf if deadline is None else self.nodes + TIME_CHECK_NODES
+
+    def can_win_next(self, current, mask):
+        return self.layout.find_winning_cells(current, mask) & self.layout.get_possible(mask) != 0
+
+    def get_non_losing_moves(self, current, mask):
+        possible = self.layout.get_possible(mask)
+        opponent_wins = self.layout.find_winning_cells(current ^ mask, mask)
+        forced = possible & opponent_wins
+        if forced:
+            # Two threats at once can't both be blocked
+            if forced & (forced - 1):
+                return 0
+            possible = forced
+        # Never play right under a cell the opponent would win in
+        return possible & ~(opponent_wins >> 1)
+
+    def negamax(self, current, mask, moves, alpha, beta):
+        # The side to move can't win immediately, the caller checked that
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            if time.perf_counter() >= self.deadline:
+                raise SearchTimeout()
+            self.next_check = self.nodes + TIME_CHECK_NODES
+
+        possible = self.get_non_losing_moves(current, mask)
+        if possible == 0:
+            return -((self.size - moves) // 2)
+        if moves >= self.size - 2:
+            return 0
+
+        lowest = -((self.size - 2 - moves) // 2)
+        if alpha < lowest:
+            alpha = lowest
+            if alpha >= beta:
+                return alpha
+        highest = (self.size - 1 - moves) // 2
+        key = current + mask
+        entry = self.tt.lookup(key)
+        if entry is not None:
+            highest = entry[3]
+        if beta > highest:
+            beta = highest
+            if alpha >= beta:
+                return beta
+
+        # Moves that make the most new threats first, center first on ties
+        ordered = []
+        for col in self.column_order:
+            move = possible & self.column_masks[col]
+            if move:
+                threats = self.layout.find_winning_cells(current | move, mask | move).bit_count()
+                ordered.append((-threats, len(ordered), move))
+        ordered.sort()
+
+        for _, _, move in ordered:
+            # The opponent becomes the side to move
+            score = -self.negamax(current ^ mask, mask | move, moves + 1, -beta, -alpha)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+
+        self.tt.store(key, 0, UPPER_BOUND, alpha, -1, 0)
+        return alpha
+
+    def solve(self, current, mask, moves):
+        if self.can_win_next(current, mask):
+            return (self.size + 1 - moves) // 2
+
+        # Narrow down the exact score with null-window searches
+        low = -((self.size - moves) // 2)
+        high = (self.size + 1 - moves) // 2
+        while low < high:
+            middle = low + (high - low) // 2
+            if middle <= 0 and int(low / 2) < middle:
+                middle = int(low / 2)
+            elif middle >= 0 and high // 2 > middle:
+                middle = high // 2
+            result = self.negamax(current, mask, moves, middle, middle + 1)
+            if result <= middle:
+                high = result
+            else:
+                low = result
+        return low
+
+    def get_plies_to_end(self, score, moves):
+        # Plies until the winning piece is dropped, counting that piece
+        if score == 0:
+            return self.size - moves
+        winner_parity = moves % 2 if score > 0 else (moves + 1) % 2
+        last = self.size + 1 - 2 * abs(score)
+        if last % 2 != winner_parity:
+            last -= 1
+        return last - moves + 1
+
+    def analyze(self, board, color_to_move, find_move=True, deadline=None):
+        self.nodes = 0
+        self.set_deadline(deadline)
+        current = board.bitboards[color_to_move]
+        mask = board.occupied
+        moves = len(board.moves)
+        score = self.solve(current, mask, moves)
+        if score > 0:
+            result = "win"
+        elif score < 0:
+            result = "loss"
+        else:
+            result = "draw"
+        analysis = {
+            "result": result,
+            "score": score,
+            "plies": self.get_plies_to_end(score, moves),
+            "nodes": self.nodes,
+        }
+
+        if find_move:
+            # A move is best if the position it leaves scores -score for
+            # the opponent
+            winning_cells = self.layout.find_winning_cells(current, mask)
+            best_move = -1
+            best_score = -inf
+            for col in self.column_order:
+                move = self.layout.get_possible(mask) & self.column_masks[col]
+                if not move:
+                    continue
+                if move & winning_cells:
+                    best_move = col
+                    break
+                child_score = -self.solve(current ^ mask, mask | move, moves + 1)
+                if child_score > best_score:
+                    best_move = col
+                    best_score = child_score
+                if best_score == score:
+                    break
+            analysis["move"] = best_move
+        self.set_deadline(None)
+        return analysis
 
 class Player:
     def __init__(self, color):
@@ -154,43 +839,784 @@ class Computer(Player):
     def __str__(self) -> str:
         return "The computer"
 
-class Game:
-    def __init__(self, height, width, hard=False):
+class Engine:
+    # Search and evaluation without any terminal I/O. Moves are 0-based
+    # columns, and the engine always plays the side to move: "computer"
+    # is that side and "player" its opponent
+    def __init__(self, height=DEFAULT_HEIGHT, width=DEFAULT_WIDTH, moves=None,
+                 first_color=RED_CIRCLE, max_depth=MAX_DEPTH, time_limit=None,
+                 evaluation=WINDOW_EVALUATION, workers=1, collect_stats=False, stats_path=None,
+                 book=None, solver_cells=SOLVER_EMPTY_CELLS, move_ordering=HEURISTIC_ORDERING,
+                 win_length=FOUR, cache=None, tt_entries=TT_MAX_ENTRIES):
+        if not MIN_WIN_LENGTH <= win_length <= max(height, width):
+            raise ValueError(f"A line must be {MIN_WIN_LENGTH} to {max(height, width)} pieces long")
+        if tt_entries < 1:
+            raise ValueError("The transposition table needs at least one entry")
+        self.board = Board(height, width, win_length)
+        self.first_color = first_color
+        self.computer = Computer(first_color)
+        self.player = Player(OPPONENT[first_color])
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.evaluation = evaluation
+        # Mirror images share table entries and root searches only when
+        # the evaluation scores them the same, which the legacy scans don't
+        self.use_symmetry = evaluation == WINDOW_EVALUATION
+        self.workers = workers
+        self.move_ordering = move_ordering
+        # Slots in the transposition table, and in the solver's and each
+        # worker process's
+        self.tt_entries = tt_entries
+        self.init_search()
+        # Stats are also collected whenever there's a file to write them to
+        self.stats = SearchStats() if collect_stats or stats_path else None
+        self.stats_path = stats_path
+        # Anything with a probe(board) method returning a column or None,
+        # normally an opening_book.OpeningBook
+        self.book = book
+        # Anything with probe(board, evaluation, depth) returning a column
+        # and score or None, and store(board, evaluation, depth, score,
+        # column), normally an analysis_cache.AnalysisCache
+        self.cache = cache
+        self.solver_cells = solver_cells
+        self.solver = None
+        if moves is not None:
+            for column in parse_moves(moves, width):
+                self.play(column)
+
+    def init_search(self):
+        self.tt = TranspositionTable(self.tt_entries)
+        self.executor = None
+        self.search_depth = MAX_DEPTH
+        self.best_score = 0
+        # Where the last move came from, one of the *_SOURCE names
+        self.move_source = None
+        # Moves the search expects from both sides, starting with its own
+        self.principal_variation = []
+        # Line found below each depth of the search in progress
+        self.pv_lines = [()] * (self.board.height * self.board.width + 2)
+        self.nodes = 0
+        self.node_limit = None
+        self.deadline = None
+        # A threading.Event another thread can set to stop the search
+        self.stop_event = None
+        self.next_check = inf
+        self.center_columns = self.board.center_columns
+        self.reset_move_ordering()
+
+    def reset_move_ordering(self):
+        # Killer moves per depth and history scores per color and cell
+        cells = self.board.width * self.board.column_bits
+        self.killers = [[-1] * KILLER_SLOTS for _ in range(self.board.height * self.board.width + 1)]
+        self.history = {color: [0] * cells for color in (RED_CIRCLE, YELLOW_CIRCLE)}
+
+    def __getstate__(self):
+        # Copies sent to search workers leave the table, pool and book
+        # behind, each worker process searches with a table of its own
+        state = self.__dict__.copy()
+        state["tt"] = None
+        state["executor"] = None
+        state["book"] = None
+        state["cache"] = None
+        state["solver"] = None
+        state["stop_event"] = None
+        return state
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def get_color_to_move(self):
+        if len(self.board.moves) % 2 == 0:
+            return self.first_color
+        return OPPONENT[self.first_color]
+
+    def get_piece(self, color):
+        if self.computer.color == color:
+            return self.computer
+        return self.player
+
+    def set_side(self, color):
+        # Scores are from the computer's point of view, so anything the
+        # table holds is for the wrong side once the colors swap
+        if self.computer.color != color:
+            self.computer.color = color
+            self.player.color = OPPONENT[color]
+            self.tt.clear()
+
+    def legal_moves(self):
+        if self.check_game_over():
+            return []
+        return self.board.get_empty_columns()
+
+    def play(self, column):
+        # Error messages number columns from 1 like the board's labels and
+        # position strings, which is how users see them
+        if column not in self.legal_moves():
+            raise ValueError(f"Column {column + 1} is not a legal move")
+        self.board.update_board(column, self.get_piece(self.get_color_to_move()))
+
+    def undo(self):
+        if not self.board.moves:
+            raise ValueError("There are no moves to undo")
+        self.board.undo_update(self.board.moves[-1])
+
+    def best_move(self, depth=None, time_limit=None, node_limit=None):
+        if not self.legal_moves():
+            raise ValueError("The game is over")
+        if depth is None:
+            depth = self.max_depth
+        if depth < 1:
+            raise ValueError("The search depth must be at least 1")
+        if time_limit is None:
+            time_limit = self.time_limit
+        self.set_side(self.get_color_to_move())
+        return self.find_best_move(depth, time_limit, node_limit)
+
+    def evaluate(self):
+        # Score of the position for the side to move
+        self.set_side(self.get_color_to_move())
+        is_winner, winner = self.check_for_winner()
+        if is_winner:
+            if winner == self.computer.color:
+                return WINNER_SCORE
+            return -WINNER_SCORE
+        if self.board.is_board_full():
+            return 0
+        return self.evaluation_function()
+
+    def get_position(self):
+        return format_moves(self.board.moves, self.board.width)
+
+    def get_solver(self):
+        if self.solver is None:
+            self.solver = Solver(self.board.height, self.board.width, self.board.win_length,
+                                 self.tt_entries)
+        return self.solver
+
+    def solve(self, find_move=True):
+        # Exact result for the side to move: win/draw/loss, the plies
+        # until the game ends and (optionally) a move that achieves it
+        if self.check_game_over():
+            raise ValueError("The game is over")
+        return self.get_solver().analyze(self.board, self.get_color_to_move(), find_move)
+
+    def get_solved_score(self, analysis):
+        # A solver result on the search's scale: what the search scores a
+        # win or loss that many plies away, and 0 for a draw
+        if analysis["result"] == "draw":
+            return 0
+        score = WINNER_SCORE - (analysis["plies"] - 1) * WIN_PLY_PENALTY
+        return score if analysis["result"] == "win" else -score
+
+    def get_search_stats(self):
+        # Stats of the last search, None unless collecting them
+        if self.stats is None:
+            return None
+        return self.stats.as_dict()
+
+    def check_game_over(self):
+        return self.check_for_winner()[0] or self.board.is_board_full()
+
+    def check_for_winner(self):
+        return self.board.check_winner()
+
+    def find_first_line(self, direction, in_a_row=None):
+        # First full line of in_a_row pieces (a line of the game by
+        # default) in the scan order of that direction, red checked first
+        if in_a_row is None:
+            in_a_row = self.board.win_length
+        red = self.board.bitboards[RED_CIRCLE]
+        yellow = self.board.bitboards[YELLOW_CIRCLE]
+        for mask in self.board.get_scan_lines(in_a_row)[direction]:
+            if red & mask == mask:
+                return True, RED_CIRCLE
+            elif yellow & mask == mask:
+                return True, YELLOW_CIRCLE
+        return False, None
+
+    def check_horizontal(self, in_a_row=None):
+        return self.find_first_line("horizontal", in_a_row)
+    
+    def check_vertical(self, in_a_row=None):
+        return self.find_first_line("vertical", in_a_row)
+    
+    def check_rising_diagonal(self, in_a_row=None):
+        return self.find_first_line("rising", in_a_row)
+    
+    def check_falling_diagonal(self, in_a_row=None):
+        return self.find_first_line("falling", in_a_row)
+    
+    def three_in_a_row_computer(self):
+        score = 0
+        in_a_row = self.board.win_length - 1
+
+        if self.check_horizontal(in_a_row) == (True, self.computer.color):
+            score += THREE_ROW_SCORE
+        if self.check_vertical(in_a_row) == (True, self.computer.color):
+            score += THREE_ROW_SCORE
+        if self.check_rising_diagonal(in_a_row) == (True, self.computer.color):
+            score += THREE_ROW_SCORE
+        if self.check_falling_diagonal(in_a_row) == (True, self.computer.color):
+            score += THREE_ROW_SCORE
+
+        return score
+    
+    def two_in_a_row_computer(self):
+        score = 0
+        in_a_row = self.board.win_length - 2
+
+        if self.check_horizontal(in_a_row) == (True, self.computer.color):
+            score += TWO_ROW_SCORE
+        if self.check_vertical(in_a_row) == (True, self.computer.color):
+            score += TWO_ROW_SCORE
+        if self.check_rising_diagonal(in_a_row) == (True, self.computer.color):
+            score += TWO_ROW_SCORE
+        if self.check_falling_diagonal(in_a_row) == (True, self.computer.color):
+            score += TWO_ROW_SCORE
+
+        return score
+
+    def three_in_a_row_player(self):
+        score = 0
+        in_a_row = self.board.win_length - 1
+
+        if self.check_horizontal(in_a_row) == (True, self.player.color):
+            score -= THREE_ROW_SCORE
+        if self.check_vertical(in_a_row) == (True, self.player.color):
+            score -= THREE_ROW_SCORE
+        if self.check_rising_diagonal(in_a_row) == (True, self.player.color):
+            score -= THREE_ROW_SCORE
+        if self.check_falling_diagonal(in_a_row) == (True, self.player.color):
+            score -= THREE_ROW_SCORE
+
+        return score
+    
+    def two_in_a_row_player(self):
+        score = 0
+        in_a_row = self.board.win_length - 2
+
+        if self.check_horizontal(in_a_row) == (True, self.player.color):
+            score -= TWO_ROW_SCORE
+        if self.check_vertical(in_a_row) == (True, self.player.color):
+            score -= TWO_ROW_SCORE
+        if self.check_rising_diagonal(in_a_row) == (True, self.player.color):
+            score -= TWO_ROW_SCORE
+        if self.check_falling_diagonal(in_a_row) == (True, self.player.color):
+            score -= TWO_ROW_SCORE
+
+        return score
+    
+    def check_for_blocks(self):
+        # Each column the player could win in with their next piece
+        threats = self.board.get_winning_cells(self.player.color) & self.board.get_legal_mask()
+        return -BLOCK_SCORE * threats.bit_count()
+    
+    def legacy_evaluation_function(self):
+        score = 0
+
+        # Three in a row
+        score += self.three_in_a_row_computer()
+        score += self.three_in_a_row_player()
+
+        # Two in a row
+        score += self.two_in_a_row_computer()
+        score += self.two_in_a_row_player()
+
+        score += self.check_for_blocks()
+        return score
+
+    def evaluation_function(self):
+        if self.evaluation == LEGACY_EVALUATION:
+            return self.legacy_evaluation_function()
+
+        # Window scores are kept up to date as pieces are dropped
+        window_scores = self.board.window_scores
+        score = window_scores[self.computer.color] - window_scores[self.player.color]
+        score += self.check_for_blocks()
+        return score
+    
+    def negamax(self, depth=0, alpha=-SEARCH_BOUND, beta=SEARCH_BOUND):
+        # Score for the side to move, depth plies below the root move: the
+        # player moves at even depths, the computer at odd ones. Every move
+        # after the first is tried with a null window around alpha and only
+        # searched again with the full window if it turns out better
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.check_limits()
+        pv_lines = self.pv_lines
+        pv_lines[depth] = ()
+
+        stats = self.stats
+        if stats is None:
+            is_winner, winner = self.board.check_last_move()
+        else:
+            stats.count_node(depth)
+            is_winner, winner = stats.time_call("check_for_winner", self.board.check_last_move)
+        # Only the side that just moved can have won, sooner being better
+        if is_winner:
+            return depth * WIN_PLY_PENALTY - WINNER_SCORE
+
+        # A tie
+        if stats is None:
+            is_full = self.board.is_board_full()
+        else:
+            is_full = stats.time_call("is_board_full", self.board.is_board_full)
+        if is_full:
+            return 0
+        # Reached max recursion depth; the evaluation is the computer's view
+        if depth == self.search_depth:
+            if stats is None:
+                score = self.evaluation_function()
+            else:
+                score = stats.time_call("evaluation_function", self.evaluation_function)
+            return score if depth % 2 else -score
+
+        # Transposition table probe, keyed on the side to move as well
+        # since either color can be the one to move in a given position.
+        # Mirror images share an entry, its move stored for the canonical one
+        to_move = self.computer if depth % 2 else self.player
+        if self.use_symmetry:
+            key, mirrored = self.board.get_canonical_key(to_move.color)
+        else:
+            key, mirrored = self.board.get_key(to_move.color), False
+        remaining = self.search_depth - depth
+        root_ply = len(self.board.moves) - depth
+        alpha_start = alpha
+        # Nodes searched with an open window don't stop at the table, so
+        # their line makes it into the principal variation
+        is_pv_node = beta - alpha > 1
+        tt_move = -1
+        entry = self.tt.lookup(key)
+        if entry is not None:
+            tt_move = entry[4]
+            if mirrored and tt_move != -1:
+                tt_move = self.board.mirror_column(tt_move)
+            if entry[5] == root_ply and entry[1] >= remaining and not is_pv_node:
+                score = entry[3]
+                if (entry[2] == EXACT or (entry[2] == LOWER_BOUND and score >= beta)
+                        or (entry[2] == UPPER_BOUND and score <= alpha)):
+                    return score
+
+        columns = self.order_moves(depth, tt_move, to_move.color)
+
+        best_score = -SEARCH_BOUND
+        best_move = -1
+        searched = 0
+        for col in columns:
+            self.board.update_board(col, to_move)
+            if searched == 0:
+                score = -self.negamax(depth + 1, -beta, -alpha)
+            else:
+                score = -self.negamax(depth + 1, -alpha - 1, -alpha)
+                if alpha < score < beta:
+                    if stats is not None:
+                        stats.researches += 1
+                    score = -self.negamax(depth + 1, -beta, -alpha)
+            self.board.undo_update(col)
+            searched += 1
+            if score > best_score:
+                best_score = score
+                best_move = col
+                if score > alpha:
+                    alpha = score
+                    pv_lines[depth] = (col,) + pv_lines[depth + 1]
+                    if alpha >= beta:
+                        self.record_cutoff(depth, col, to_move.color)
+                        if stats is not None:
+                            stats.count_cutoff(searched)
+                        break
+
+        if best_score <= alpha_start:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        if mirrored:
+            best_move = self.board.mirror_column(best_move)
+        self.tt.store(key, remaining, flag, best_score, best_move, root_ply)
+        return best_score
+
+    def check_limits(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchTimeout()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+        self.next_check = self.nodes + TIME_CHECK_NODES
+        if self.node_limit is not None:
+            self.next_check = min(self.next_check, self.node_limit)
+
+    def set_limits(self, deadline, node_limit):
+        self.deadline = deadline
+        self.node_limit = node_limit
+        if deadline is None and node_limit is None and self.stop_event is None:
+            self.next_check = inf
+        else:
+            self.next_check = self.nodes
+
+    def get_root_columns(self):
+        columns = [col for col in self.center_columns if self.board.is_column_open(col)]
+        if self.use_symmetry and self.board.is_symmetric():
+            # Mirrored moves lead to mirror images with the same score, so
+            # only the first of each pair in search order is searched
+            columns = [col for col in columns
+                       if columns.index(self.board.mirror_column(col)) >= columns.index(col)]
+        return columns
+
+    def order_moves(self, depth, tt_move, color):
+        # Open columns in the order the search should try them. Subclasses
+        # can override this to try other orderings
+        board = self.board
+        if self.move_ordering == CENTER_ORDERING:
+            columns = [col for col in self.center_columns if board.is_column_open(col)]
+            if tt_move != -1:
+                columns.remove(tt_move)
+                columns.insert(0, tt_move)
+            return columns
+
+        # Winning moves, then forced blocks, the table's move, killer
+        # moves and finally history scores, with center first on ties
+        legal = board.get_legal_mask()
+        wins = board.get_winning_cells(color) & legal
+        blocks = board.get_winning_cells(OPPONENT[color]) & legal
+        killers = self.killers[depth]
+        history = self.history[color]
+        ranked = []
+        for rank, col in enumerate(self.center_columns):
+            if board.heights[col] == board.height:
+                continue
+            index = col * board.column_bits + board.heights[col]
+            if wins >> index & 1:
+                priority = 0
+            elif blocks >> index & 1:
+                priority = 1
+            elif col == tt_move:
+                priority = 2
+            elif col in killers:
+                priority = 3
+            else:
+                priority = 4
+            ranked.append((priority, -history[index], rank, col))
+        ranked.sort()
+        return [move[3] for move in ranked]
+
+    def record_cutoff(self, depth, col, color):
+        # The move that caused a cutoff is tried early at this depth
+        # elsewhere in the tree, and in this cell from now on
+        killers = self.killers[depth]
+        if killers[0] != col:
+            killers.pop()
+            killers.insert(0, col)
+        remaining = self.search_depth - depth
+        index = col * self.board.column_bits + self.board.heights[col]
+        self.history[color][index] += remaining * remaining
+
+    def search_root(self, columns, depth, alpha=-SEARCH_BOUND, beta=SEARCH_BOUND):
+        # The first column gets the whole window and the rest a null window,
+        # so the move kept is the first one with the best score, same as
+        # scoring every column exactly
+        best_score = -SEARCH_BOUND
+        best_move = -1
+        self.search_depth = depth
+
+        for col in columns:
+            self.board.update_board(col, self.computer)
+            if best_move == -1:
+                current_score = -self.negamax(0, -beta, -alpha)
+            else:
+                current_score = -self.negamax(0, -alpha - 1, -alpha)
+                if alpha < current_score < beta:
+                    if self.stats is not None:
+                        self.stats.researches += 1
+                    current_score = -self.negamax(0, -beta, -alpha)
+            self.board.undo_update(col)
+
+            if current_score > best_score:
+                best_move = col
+                best_score = current_score
+                if current_score > alpha:
+                    alpha = current_score
+                    self.principal_variation = [col, *self.pv_lines[0]]
+                    if alpha >= beta:
+                        break
+
+        return best_move, best_score
+
+    def search_root_parallel(self, columns, depth, deadline, node_limit):
+        # Every root column is searched with a full window in its own
+        # process, so the move picked from the scores in column order
+        # matches the serial search at the same depth
+        time_limit = None
+        if deadline is not None:
+            time_limit = max(deadline - time.perf_counter(), 0)
+        column_node_limit = None
+        if node_limit is not None:
+            column_node_limit = max(node_limit - self.nodes, 0) // len(columns)
+        executor = self.get_executor()
+        futures = [
+            executor.submit(search_root_column, self, col, depth, time_limit, column_node_limit)
+            for col in columns
+        ]
+        best_score = -SEARCH_BOUND
+        best_move = -1
+        timed_out = False
+
+        for col, future in zip(columns, futures):
+            current_score, line, nodes, worker_stats = future.result()
+            self.nodes += nodes
+            if worker_stats is not None:
+                self.stats.merge(worker_stats)
+            if current_score is None:
+                timed_out = True
+            elif current_score > best_score:
+                best_move = col
+                best_score = current_score
+                self.principal_variation = [col, *line]
+
+        if timed_out:
+            raise SearchTimeout()
+        return best_move, best_score
+
+    def search_aspiration(self, columns, depth, previous_move):
+        # Searches with a narrow window around the last iteration's score,
+        # opening the side it fell outside of and searching again until
+        # the score lands inside
+        if previous_move == -1:
+            alpha, beta = -SEARCH_BOUND, SEARCH_BOUND
+        else:
+            alpha = self.best_score - ASPIRATION_WINDOW
+            beta = self.best_score + ASPIRATION_WINDOW
+        while True:
+            best_move, best_score = self.search_root(columns, depth, alpha, beta)
+            if best_score <= alpha:
+                alpha = -SEARCH_BOUND
+            elif best_score >= beta:
+                beta = SEARCH_BOUND
+            else:
+                return best_move, best_score
+            if self.stats is not None:
+                self.stats.aspiration_researches += 1
+
+    def find_best_move(self, max_depth=MAX_DEPTH, time_limit=None, node_limit=None):
+        # Stats are started and written here so moves from the book, cache
+        # and solver get a line of their own instead of the last search's
+        stats = self.stats
+        if stats is not None:
+            stats.reset()
+            search_start = time.perf_counter()
+            tt_hits, tt_misses = self.tt.hits, self.tt.misses
+        self.principal_variation = []
+        self.nodes = 0
+        best_move = self.choose_move(max_depth, time_limit, node_limit)
+        if stats is not None:
+            stats.source = self.move_source
+            stats.seconds = time.perf_counter() - search_start
+            stats.tt_hits = self.tt.hits - tt_hits
+            stats.tt_misses = self.tt.misses - tt_misses
+            if self.stats_path:
+                stats.dump(self.stats_path)
+        return best_move
+
+    def choose_move(self, max_depth, time_limit, node_limit):
+        # The book's move, the solver's, a cached one or a search's, in
+        # that order, with move_source saying which
+        if self.book is not None:
+            book_move = self.book.probe(self.board)
+            if book_move is not None and self.board.is_column_open(book_move):
+                self.principal_variation = [book_move]
+                self.move_source = BOOK_SOURCE
+                return book_move
+
+        deadline = None
+        if time_limit is not None:
+            deadline = time.perf_counter() + time_limit
+        moves_played = len(self.board.moves)
+        empty_cells = self.board.height * self.board.width - moves_played
+        # Deepest iteration the search can run, past it every line has
+        # reached the end of the game
+        full_depth = max(min(max_depth, empty_cells - 1), 1)
+
+        # Few enough empty cells to search to the end of the game. Before
+        # the cache, whose results are only as good as their search
+        if empty_cells <= self.solver_cells:
+            try:
+                analysis = self.get_solver().analyze(self.board, self.computer.color, deadline=deadline)
+                self.best_score = self.get_solved_score(analysis)
+                self.nodes = analysis["nodes"]
+                self.principal_variation = [analysis["move"]]
+                self.move_source = SOLVER_SOURCE
+                return analysis["move"]
+            except SearchTimeout:
+                pass
+
+        # Searched at least this deep before, maybe by another process
+        if self.cache is not None:
+            cached = self.cache.probe(self.board, self.evaluation, full_depth)
+            if cached is not None and self.board.is_column_open(cached[0]):
+                self.principal_variation = [cached[0]]
+                self.best_score = cached[1]
+                self.move_source = CACHE_SOURCE
+                return cached[0]
+
+        # Iterative deepening: search depth 1, 2, ... until max_depth or
+        # the time/node budget runs out, keeping the deepest finished result
+        self.nodes = 0
+        self.reset_move_ordering()
+        columns = self.get_root_columns()
+        best_move = -1
+        stats = self.stats
+        principal_variation = []
+        finished_depth = 0
+        for depth in range(1, max_depth + 1):
+            iteration_start = time.perf_counter()
+            iteration_nodes = self.nodes
+            # The first iteration always finishes so there's a move to play
+            if best_move == -1:
+                limits = (None, None)
+            else:
+                limits = (deadline, node_limit)
+            try:
+                if self.workers > 1:
+                    best_move, self.best_score = self.search_root_parallel(columns, depth, *limits)
+                else:
+                    self.set_limits(*limits)
+                    best_move, self.best_score = self.search_aspiration(columns, depth, best_move)
+            except SearchTimeout:
+                # Take back the moves of the abandoned search
+                while len(self.board.moves) > moves_played:
+                    self.board.undo_update(self.board.moves[-1])
+                break
+            principal_variation = self.principal_variation
+            finished_depth = depth
+
+            if stats is not None:
+                stats.iterations.append({
+                    "depth": depth,
+                    "nodes": self.nodes - iteration_nodes,
+                    "seconds": time.perf_counter() - iteration_start,
+                    "best_move": best_move,
+                    "score": self.best_score,
+                    "principal_variation": principal_variation,
+                })
+
+            # The best move leads the next, deeper iteration
+            columns.remove(best_move)
+            columns.insert(0, best_move)
+
+            # Every line already reaches the end of the game
+            if depth + 1 >= empty_cells:
+                break
+
+        # Only a finished iteration's line goes with its move
+        self.principal_variation = principal_variation
+        if self.cache is not None and finished_depth:
+            self.cache.store(self.board, self.evaluation, finished_depth, self.best_score, best_move)
+        self.set_limits(None, None)
+        self.move_source = SEARCH_SOURCE
+        return best_move
+
+class Game(Engine):
+    def __init__(self, height, width, hard=False, max_depth=MAX_DEPTH, time_limit=None,
+                 evaluation=WINDOW_EVALUATION, workers=1, stats_path=None, book=None,
+                 solver_cells=SOLVER_EMPTY_CELLS, move_ordering=HEURISTIC_ORDERING, record_path=None,
+                 win_length=FOUR, ponder=False, cache=None, rendering=FULL_RENDERING,
+                 tt_entries=TT_MAX_ENTRIES):
+        super().__init__(height, width, max_depth=max_depth, time_limit=time_limit,
+                         evaluation=evaluation, workers=workers, stats_path=stats_path,
+                         book=book, solver_cells=solver_cells, move_ordering=move_ordering,
+                         win_length=win_length, cache=cache, tt_entries=tt_entries)
+        self.board.rendering = rendering
+        self.record_path = record_path
+        self.ponderer = None
+        if ponder:
+            from ponder import Ponderer
+            self.ponderer = Ponderer(self)
+        # What pondering found for the move the player just made
+        self.pondered = None
         self.play_again = True
         self.winner = None
-        self.board = Board(height, width)
         self.intro_print()
         self.hard = self.get_difficulty()
         self.player = Player(self.pick_piece())
         self.computer = Computer(self.set_computer_piece())
         self.games = 0
 
+    def __getstate__(self):
+        # The ponderer's thread and event can't be pickled, and search
+        # workers have no use for it or what it found
+        state = super().__getstate__()
+        state["ponderer"] = None
+        state["pondered"] = None
+        return state
+
+    def choose_move(self, max_depth, time_limit, node_limit):
+        # A reply pondered all the way to max_depth is played as found
+        pondered = self.pondered
+        self.pondered = None
+        if pondered is not None and pondered.move is not None:
+            self.best_score = pondered.score
+            self.principal_variation = pondered.principal_variation
+            self.move_source = PONDER_SOURCE
+            return pondered.move
+        return super().choose_move(max_depth, time_limit, node_limit)
+
     def print_instructions(self):
         first_string_length = len("Type the column number you want to drop")
-        second_string_length = len("your piece into. Get 4 in a row and you win!")
+        second_string = f"your piece into. Get {self.board.win_length} in a row and you win!"
         first_spacing = (((self.board.width * COLUMN_WIDTH) + 1) - first_string_length) // 2
-        second_spacing = (((self.board.width * COLUMN_WIDTH) + 1) - second_string_length) // 2
-        print("\n" + (" " * first_spacing) + "Type the column number you want to drop")
-        print((" " * second_spacing) + "your piece into. Get 4 in a row and you win!\n")
-        
+        second_spacing = (((self.board.width * COLUMN_WIDTH) + 1) - len(second_string)) // 2
+        self.say("\n" + (" " * first_spacing) + "Type the column number you want to drop")
+        self.say((" " * second_spacing) + second_string + "\n")
+
+    def say(self, text):
+        # print() for text under the board, counted so diff rendering can
+        # tell when it has scrolled the board
+        print(text)
+        self.board.count_lines_below(text + "\n")
+
+    def ask(self, prompt):
+        # input() for prompts under the board, counted like say()
+        answer = input(prompt)
+        self.board.count_lines_below(prompt + answer + "\n")
+        return answer
+
+    def pause(self):
+        self.ask("Press ENTER to continue")
+
     def intro_print(self):
-        # Prints information following instructions at launch
-        self.print_instructions()
-        self.board.print_default_board()
+        # Prints information following instructions at launch. Diff
+        # rendering draws the board at the top of a cleared screen, so
+        # there the instructions go under it
+        if self.board.rendering == DIFF_RENDERING:
+            self.board.print_default_board()
+            self.print_instructions()
+        else:
+            self.print_instructions()
+            self.board.print_default_board()
         self.board.print_board_size()
 
     def reset_board(self):
-        self.board = Board(self.board.height, self.board.width)
+        self.board = Board(self.board.height, self.board.width, self.board.win_length, self.board.rendering)
 
     def reset_game(self):
         self.reset_board()
         self.winner = None
+        self.pondered = None
 
     def get_difficulty(self):
         while True:
             try:
                 options = ["easy", "e", "hard", "h"]
-                difficulty = input("\nSelect the difficulty (Easy/Hard): ").lower()
+                difficulty = self.ask("\nSelect the difficulty (Easy/Hard): ").lower()
                 if difficulty in options[:2]:
                     return False
                 elif difficulty in options[2:]:
@@ -198,13 +1624,13 @@ class Game:
                 else:
                     raise ValueError()
             except ValueError:
-                print("Invalid input. Please type 'easy' or 'hard'.")
+                self.say("Invalid input. Please type 'easy' or 'hard'.")
         
     def get_play_again(self):
         play_list = ["n", "y"]
         while True:     
             try:   
-                play = input("Play again? (y/n) ").lower()
+                play = self.ask("Play again? (y/n) ").lower()
                 if play in play_list:
                     if play == "y":
                         self.play_again = True
@@ -215,13 +1641,13 @@ class Game:
                 else:
                     raise ValueError()
             except ValueError:
-                print("Please type either y or n.")
+                self.say("Please type either y or n.")
 
     def pick_piece(self):
         options = ["red", "r", "y", "yellow"]
         while True:
             try:
-                player_piece = input(f"Which color would you like to play as? ({YELLOW_CIRCLE} /{RED_CIRCLE}) ").lower()
+                player_piece = self.ask(f"Which color would you like to play as? ({YELLOW_CIRCLE} /{RED_CIRCLE}) ").lower()
                 if player_piece in options[:2]:
                     return RED_CIRCLE
                 elif player_piece in options[2:]:
@@ -229,7 +1655,7 @@ class Game:
                 else:
                     raise ValueError()
             except ValueError:
-                print("Invalid input. Please type 'red' or 'yellow'")
+                self.say("Invalid input. Please type 'red' or 'yellow'")
 
     def set_computer_piece(self):
         if self.player.color == RED_CIRCLE:
@@ -239,7 +1665,7 @@ class Game:
         
     def determine_first(self):
         first = random.choice([self.player, self.computer])
-        print(f"{str(first)} will go first.")
+        self.say(f"{str(first)} will go first.")
         return first
     
     def get_player_turn(self):
@@ -249,7 +1675,7 @@ class Game:
             empty_columns.append(col)
         while True:
             try:
-                turn = input("Where would you like to drop your piece: ")
+                turn = self.ask("Where would you like to drop your piece: ")
                 if turn.isnumeric():
                     turn = int(turn)
                     if turn in empty_columns:
@@ -260,24 +1686,32 @@ class Game:
                 else:
                     raise ValueError()
             except ValueError:
-                print(f"Please choose an empty column: {empty_columns}")
+                self.say(f"Please choose an empty column: {empty_columns}")
 
     def easy_computer_turn(self):
         # Randomly choose a spot on the board
         empty_columns = self.board.get_empty_columns()
         turn = random.choice(empty_columns)
-        pause()
+        self.pause()
         self.board.update_board(turn, self.computer)
         self.board.print_current_board(turn)
 
     def hard_computer_turn(self):
-        turn = self.find_best_move()
-        pause()
+        if self.pondered is not None:
+            # Carry on from the work done while the player was thinking
+            self.tt = self.pondered.tt
+        turn = self.find_best_move(self.max_depth, self.time_limit)
+        self.pause()
         self.board.update_board(turn, self.computer)
         self.board.print_current_board(turn)
     
     def player_turn(self):
+        pondering = self.hard and self.ponderer is not None
+        if pondering:
+            self.ponderer.start()
         turn = self.get_player_turn()
+        if pondering:
+            self.pondered = self.ponderer.finish(turn)
         self.board.update_board(turn, self.player)
         self.board.print_current_board(turn)
     
@@ -308,250 +1742,6 @@ class Game:
         self.player_turn()
         if self.check_game_over():
             return
-
-    def check_game_over(self):
-        return self.check_for_winner()[0] or self.board.is_board_full()
-
-    def check_for_winner(self):
-        horizontal_win, winner = self.check_horizontal()
-        if horizontal_win:
-            return True, winner
-
-        vertical_win, winner = self.check_vertical()
-        if vertical_win:
-            return True, winner
-
-        rising_diagonal_win, winner = self.check_rising_diagonal()
-        if rising_diagonal_win:
-            return True, winner
-
-        falling_diagonal_win, winner = self.check_falling_diagonal()
-        if falling_diagonal_win:
-            return True, winner
-        
-        return False, None
-
-    def check_horizontal(self, in_a_row=FOUR):
-        spots = self.board.board_spots
-        for row in range(self.board.height):
-            red_check = 0
-            yellow_check = 0
-            for col in range(self.board.width):
-                if spots[row][col] == RED_CIRCLE:
-                    red_check += 1
-                    yellow_check = 0
-                elif spots[row][col] == YELLOW_CIRCLE:
-                    yellow_check += 1
-                    red_check = 0
-                else:
-                    red_check = 0
-                    yellow_check = 0
-                if red_check >= in_a_row:
-                    return True, RED_CIRCLE
-                elif yellow_check >= in_a_row:
-                    return True, YELLOW_CIRCLE
-        return False, None
-    
-    def check_vertical(self, in_a_row=FOUR):
-        spots = self.board.board_spots
-        for col in range(self.board.width):
-            red_check = 0
-            yellow_check = 0
-            for row in range(self.board.height):
-                if spots[row][col] == RED_CIRCLE:
-                    red_check += 1
-                    yellow_check = 0
-                elif spots[row][col] == YELLOW_CIRCLE:
-                    yellow_check += 1
-                    red_check = 0
-                else:
-                    red_check = 0
-                    yellow_check = 0
-                if red_check >= in_a_row :
-                    return True, RED_CIRCLE
-                elif yellow_check >= in_a_row:
-                    return True, YELLOW_CIRCLE
-        return False, None
-    
-    def check_rising_diagonal(self, in_a_row=FOUR):
-        spots = self.board.board_spots
-        for row in range(self.board.height - 1, in_a_row - 2, -1):
-            for col in range(self.board.width - in_a_row + 1):
-                if all(spots[row - n][col + n] == RED_CIRCLE for n in range(in_a_row)):
-                    return True, RED_CIRCLE
-                elif all(spots[row - n][col + n] == YELLOW_CIRCLE for n in range(in_a_row)):
-                    return True, YELLOW_CIRCLE
-        return False, None
-    
-    def check_falling_diagonal(self, in_a_row=FOUR):
-        spots = self.board.board_spots
-        for row in range(self.board.height - in_a_row + 1):
-            for col in range(self.board.width - in_a_row + 1):
-                if all(spots[row + n][col + n] == RED_CIRCLE for n in range(in_a_row)):
-                    return True, RED_CIRCLE
-                elif all(spots[row + n][col + n] == YELLOW_CIRCLE for n in range(in_a_row)):
-                    return True, YELLOW_CIRCLE
-        return False, None
-    
-    def three_in_a_row_computer(self):
-        score = 0
-
-        if self.check_horizontal(THREE) == (True, self.computer.color):
-            score += THREE_ROW_SCORE
-        if self.check_vertical(THREE) == (True, self.computer.color):
-            score += THREE_ROW_SCORE
-        if self.check_rising_diagonal(THREE) == (True, self.computer.color):
-            score += THREE_ROW_SCORE
-        if self.check_falling_diagonal(THREE) == (True, self.computer.color):
-            score += THREE_ROW_SCORE
-
-        return score
-    
-    def two_in_a_row_computer(self):
-        score = 0
-
-        if self.check_horizontal(TWO) == (True, self.computer.color):
-            score += TWO_ROW_SCORE
-        if self.check_vertical(TWO) == (True, self.computer.color):
-            score += TWO_ROW_SCORE
-        if self.check_rising_diagonal(TWO) == (True, self.computer.color):
-            score += TWO_ROW_SCORE
-        if self.check_falling_diagonal(TWO) == (True, self.computer.color):
-            score += TWO_ROW_SCORE
-
-        return score
-
-    def three_in_a_row_player(self):
-        score = 0
-
-        if self.check_horizontal(THREE) == (True, self.player.color):
-            score -= THREE_ROW_SCORE
-        if self.check_vertical(THREE) == (True, self.player.color):
-            score -= THREE_ROW_SCORE
-        if self.check_rising_diagonal(THREE) == (True, self.player.color):
-            score -= THREE_ROW_SCORE
-        if self.check_falling_diagonal(THREE) == (True, self.player.color):
-            score -= THREE_ROW_SCORE
-
-        return score
-    
-    def two_in_a_row_player(self):
-        score = 0
-
-        if self.check_horizontal(TWO) == (True, self.player.color):
-            score -= TWO_ROW_SCORE
-        if self.check_vertical(TWO) == (True, self.player.color):
-            score -= TWO_ROW_SCORE
-        if self.check_rising_diagonal(TWO) == (True, self.player.color):
-            score -= TWO_ROW_SCORE
-        if self.check_falling_diagonal(TWO) == (True, self.player.color):
-            score -= TWO_ROW_SCORE
-
-        return score
-    
-    def check_for_blocks(self):
-        score = 0
-        empty_columns = self.board.get_empty_columns()
-
-        for col in empty_columns:
-            self.board.update_board(col, self.player)
-            
-            is_winner, winner = self.check_for_winner()
-
-            if is_winner and winner == self.player.color:
-                score -= BLOCK_SCORE
-
-            self.board.undo_update(col)
-        
-        return score
-    
-    def evaluation_function(self):
-        score = 0
-
-        # Three in a row
-        score += self.three_in_a_row_computer()
-        score += self.three_in_a_row_player()
-
-        # Two in a row
-        score += self.two_in_a_row_computer()
-        score += self.two_in_a_row_player()
-
-        score += self.check_for_blocks()
-        return score
-    
-    def minimax(self, is_maximizing=False, depth=0, alpha=(-inf), beta=(inf)):
-        is_winner, winner = self.check_for_winner()
-        if is_winner:
-            if winner == self.computer.color:
-                return WINNER_SCORE - (depth * 5)
-            elif winner == self.player.color:
-                return -WINNER_SCORE + (depth * 5)
-        
-        # A tie
-        if self.board.is_board_full():
-            return 0
-        # Reached max recursion depth
-        if depth == MAX_DEPTH:
-            return self.evaluation_function()
-        
-        empty_columns = self.board.get_empty_columns()
-        
-        if is_maximizing:
-            best_score = float(-inf)
-            for col in range(self.board.width):
-                if col in empty_columns:
-                    self.board.update_board(col, self.computer)
-                    new_score = self.minimax(not is_maximizing, depth+1, alpha, beta)
-                    self.board.undo_update(col)
-                    best_score = max(best_score, new_score)
-                    alpha = max(alpha, best_score)
-                    if beta <= alpha:
-                        break
-            return best_score
-        
-        else:
-            best_score = float(inf)
-            for col in range(self.board.width):
-                    if col in empty_columns:
-                        self.board.update_board(col, self.player)
-                        new_score = self.minimax(not is_maximizing, depth+1, alpha, beta)
-                        self.board.undo_update(col)
-                        best_score = min(best_score, new_score)
-                        beta = min(beta, best_score)
-                        if beta <= alpha:
-                            break
-            return best_score
-        
-    def find_best_move(self):
-        best_score = (-inf)
-        best_move = -1
-        empty_columns = self.board.get_empty_columns()
-
-        # Sets up an alternating move checker
-        # prioritizing middle of the board and
-        # moving outwards from there
-        middle = self.board.width // 2
-        columns = [middle]
-        for n in range(1, middle + 1):
-            if middle + n < self.board.width:
-                columns.append(middle + n)
-            if middle - n >= 0:
-                columns.append(middle - n)
-
-        for col in columns:
-            if col in empty_columns:
-                self.board.update_board(col, self.computer)
-
-                current_score = self.minimax()
-
-                self.board.undo_update(col)
-
-                if current_score > best_score:
-                    best_move = col
-                    best_score = current_score
-
-        return best_move
-    
     def set_winner(self):
         winner = self.check_for_winner()[1]
         self.winner = winner
@@ -569,9 +1759,16 @@ class Game:
         print(f"Losses: {self.computer.score}")
         print(f"Ties:   {self.games - self.player.score - self.computer.score}")
     
+    def save_record(self):
+        from game_records import GameRecordWriter, record_game
+        with GameRecordWriter(self.record_path, append=True) as writer:
+            writer.write(record_game(self))
+
     def end_game(self):
         self.games += 1
         self.set_winner()
+        if self.record_path:
+            self.save_record()
         self.update_scores()
         self.print_scores()
         print()
@@ -580,17 +1777,138 @@ class Game:
                     
 
 
+def parse_moves(moves, width):
+    # Accepts a list of 0-based columns or a position string of 1-based
+    # columns: one digit per move, or separated by commas/spaces (needed
+    # once the board is ten or more columns wide)
+    if isinstance(moves, str):
+        tokens = moves.replace(",", " ").split()
+        if len(tokens) == 1 and width < DOUBLE_DIGIT_INT:
+            tokens = list(tokens[0])
+        columns = [int(token) - 1 for token in tokens]
+    else:
+        columns = list(moves)
+    for column in columns:
+        if not 0 <= column < width:
+            raise ValueError(f"Column {column + 1} is off the board")
+    return columns
+
+def format_moves(moves, width):
+    if width < DOUBLE_DIGIT_INT:
+        return "".join(str(column + 1) for column in moves)
+    return ",".join(str(column + 1) for column in moves)
+
+
+worker_tt = None
+
+def search_root_column(game, column, depth, time_limit=None, node_limit=None):
+    # Runs in a worker process on a copy of the game. The process keeps
+    # one transposition table across tasks so later iterations and moves
+    # reuse what earlier ones found
+    global worker_tt
+    if worker_tt is None:
+        worker_tt = TranspositionTable(game.tt_entries)
+    game.tt = worker_tt
+    deadline = None
+    if time_limit is not None:
+        deadline = time.perf_counter() + time_limit
+    game.nodes = 0
+    if game.stats is not None:
+        game.stats.reset()
+    game.set_limits(deadline, node_limit)
+    game.search_depth = depth
+    game.board.update_board(column, game.computer)
+    try:
+        score = -game.negamax()
+    except SearchTimeout:
+        score = None
+    line = list(game.pv_lines[0])
+    if game.stats is None:
+        return score, line, game.nodes, None
+    return score, line, game.nodes, game.stats.as_dict()
+
+
+def run_solve(args):
+    # Reuses one solver so later positions benefit from its table
+    solver = Solver(args.height, args.width, args.connect, args.tt_entries)
+    lines = open(args.input) if args.input else sys.stdin
+    for line in lines:
+        position = line.strip()
+        if not position:
+            continue
+        result = {"position": position}
+        try:
+            engine = Engine(args.height, args.width, position, win_length=args.connect)
+            if engine.check_game_over():
+                raise ValueError("The game is over")
+            result.update(solver.analyze(engine.board, engine.get_color_to_move()))
+        except ValueError as error:
+            result["error"] = str(error)
+        print(json.dumps(result), flush=True)
+    if args.input:
+        lines.close()
+
+
 def parse_args():
     # Parse command-line arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("--height", type=int, default=DEFAULT_HEIGHT, help="Height of the board")
     parser.add_argument("--width", type=int, default=DEFAULT_WIDTH, help="Width of the board")
-    return parser.parse_args()
-
-def pause():
-    while True:
-        input("Press ENTER to continue")
-        break
+    parser.add_argument("--connect", type=int, default=FOUR, help="Pieces in a row needed to win")
+    parser.add_argument("--depth", type=int, default=MAX_DEPTH, help="Deepest search in hard mode")
+    parser.add_argument("--time", type=float, default=None, help="Seconds hard mode may think per move")
+    parser.add_argument("--evaluation", choices=[WINDOW_EVALUATION, LEGACY_EVALUATION],
+                        default=WINDOW_EVALUATION, help="Position scoring used by hard mode")
+    parser.add_argument("--workers", type=int, default=1, help="Processes hard mode searches with")
+    parser.add_argument("--stats", help="Append search stats for every hard mode move to this JSON lines file")
+    parser.add_argument("--book", help="Opening book file made by opening_book.py")
+    parser.add_argument("--cache", help="Analysis cache file to share searches through, created if missing")
+    parser.add_argument("--solver-cells", type=int, default=SOLVER_EMPTY_CELLS,
+                        help="Solve positions exactly once this few cells are empty")
+    parser.add_argument("--move-ordering", choices=[HEURISTIC_ORDERING, CENTER_ORDERING],
+                        default=HEURISTIC_ORDERING, help="Order hard mode tries moves in")
+    parser.add_argument("--tt-entries", type=int, default=TT_MAX_ENTRIES,
+                        help="Transposition table slots, per search process (caps its memory)")
+    parser.add_argument("--record", help="Append every finished game to this packed record file")
+    parser.add_argument("--render", choices=[FULL_RENDERING, DIFF_RENDERING], default=FULL_RENDERING,
+                        help="Redraw the whole board every move, or only what changed (ANSI terminals)")
+    parser.add_argument("--ponder", action="store_true",
+                        help="Let hard mode think about its replies while you pick a move")
+    subparsers = parser.add_subparsers(dest="command")
+
+    self_play = subparsers.add_parser("selfplay", help="Play many games between two agents")
+    self_play.add_argument("--games", type=int, default=100, help="Number of games to play")
+    self_play.add_argument("--agent-a", default="depth:3",
+                           help="random, depth:<plies>, time:<seconds> or mcts:<seconds> per move")
+    self_play.add_argument("--agent-b", default="random",
+                           help="random, depth:<plies>, time:<seconds> or mcts:<seconds> per move")
+    self_play.add_argument("--jobs", type=int, default=1, help="Processes to play games in")
+    self_play.add_argument("--random-opening", type=int, default=2,
+                           help="Random moves played at the start of every game")
+    self_play.add_argument("--seed", type=int, default=0, help="Seed for the random moves")
+    self_play.add_argument("--output", help="JSON lines file to write each game to")
+    self_play.add_argument("--records", help="Packed record file to write each game to")
+
+    solve = subparsers.add_parser("solve", help="Solve positions exactly, one per line")
+    solve.add_argument("input", nargs="?", help="File of positions (defaults to stdin)")
+
+    analyze = subparsers.add_parser(
+        "analyze", help="Search positions in bulk with --depth/--time, one per line")
+    analyze.add_argument("input", nargs="?", help="File of positions (defaults to stdin)")
+    analyze.add_argument("--records", action="store_true",
+                         help="Read a game record file and analyze the position before every move")
+    analyze.add_argument("--output", help="JSON lines file to write (defaults to stdout)")
+    analyze.add_argument("--jobs", type=int, default=1, help="Processes to search in")
+    analyze.add_argument("--chunk-size", type=int, default=64,
+                         help="Positions handed to a process at a time")
+    args = parser.parse_args()
+    if not MIN_WIN_LENGTH <= args.connect <= max(args.height, args.width):
+        parser.error(f"--connect must be between {MIN_WIN_LENGTH} and the board's longest side")
+    if args.depth < 1:
+        parser.error("--depth must be at least 1")
+    if args.tt_entries < 1:
+        parser.error("--tt-entries must be at least 1")
+    return args
 
 
 
@@ -600,8 +1918,34 @@ def main():
     height = args.height
     width = args.width
 
+    if args.command == "selfplay":
+        from self_play import run_self_play
+        run_self_play(args)
+        return
+    elif args.command == "solve":
+        run_solve(args)
+        return
+    elif args.command == "analyze":
+        from analyze import run_analyze
+        run_analyze(args)
+        return
+
+    book = None
+    if args.book:
+        from opening_book import OpeningBook
+        book = OpeningBook(args.book)
+    cache = None
+    if args.cache:
+        from analysis_cache import AnalysisCache
+        cache = AnalysisCache(args.cache)
+
     # Initialize game and print instructions/board
-    connect_four = Game(height, width)
+    connect_four = Game(height, width, max_depth=args.depth, time_limit=args.time,
+                        evaluation=args.evaluation, workers=args.workers, stats_path=args.stats,
+                        book=book, solver_cells=args.solver_cells,
+                        move_ordering=args.move_ordering, record_path=args.record,
+                        win_length=args.connect, ponder=args.ponder, cache=cache,
+                        rendering=args.render, tt_entries=args.tt_entries)
     while connect_four.play_again:
         # Reset game to play again after first
         if connect_four.games > 0:
@@ -618,6 +1962,7 @@ def main():
                 connect_four.computer_start()
         # Once the game is over, update/print scores
         connect_four.end_game()
+    connect_four.close()
 
     
 
@@ -0,0 +1,259 @@
+"""
+Game records: a one-line text notation and a packed binary format for
+storing many games, streaming readers/writers for both, and a replay
+tool that rebuilds any position of a recorded game through the engine.
+
+Text notation, one game per line: "<height>x<width> <moves> <result>",
+moves as 1-based columns like position strings elsewhere and the result
+as 1-0 (first player won), 0-1, 1/2 or * (unfinished), e.g.
+    6x7 4455664 1-0
+Games won with a line other than four add it to the size: 9x10x5.
+
+Packed files (little endian) start with a magic and a version byte. Each
+game is then height, width, win length, result and move count, followed
+by the moves two to a byte (one per byte on boards wider than 16
+columns), so a typical 6x7 game takes about 20 bytes.
+"""
+
+
+
+import argparse
+import struct
+import sys
+
+from connect_four import Engine, FOUR, parse_moves, format_moves
+
+
+
+RECORDS_MAGIC = b"C4GR"
+RECORDS_VERSION = 1
+FILE_HEADER = struct.Struct("<4sB")
+GAME_HEADER = struct.Struct("<BBBBH")
+# Widest board whose columns fit in half a byte
+NIBBLE_WIDTH = 16
+UNFINISHED = 0
+FIRST_WIN = 1
+SECOND_WIN = 2
+DRAW = 3
+RESULT_NOTATION = {UNFINISHED: "*", FIRST_WIN: "1-0", SECOND_WIN: "0-1", DRAW: "1/2"}
+NOTATION_RESULTS = {notation: result for result, notation in RESULT_NOTATION.items()}
+PACKED_FORMAT = "packed"
+TEXT_FORMAT = "text"
+
+
+
+class GameRecord:
+    __slots__ = ("height", "width", "moves", "result", "win_length")
+
+    def __init__(self, height, width, moves, result=UNFINISHED, win_length=FOUR):
+        # moves are 0-based columns
+        self.height = height
+        self.width = width
+        self.moves = list(moves)
+        self.result = result
+        self.win_length = win_length
+
+    def __eq__(self, other):
+        return (isinstance(other, GameRecord) and self.height == other.height
+                and self.width == other.width and self.moves == other.moves
+                and self.result == other.result and self.win_length == other.win_length)
+
+    def __repr__(self):
+        return f"GameRecord({format_record(self)!r})"
+
+    def get_engine(self, ply=None):
+        # The position after the first ply moves (all of them by default)
+        return Engine(self.height, self.width, self.moves[:ply], win_length=self.win_length)
+
+
+def get_result(engine):
+    # Result of the engine's game so far, by who moved first rather than color
+    is_winner, _ = engine.check_for_winner()
+    if is_winner:
+        # Only the side that just moved can have won
+        return FIRST_WIN if len(engine.board.moves) % 2 == 1 else SECOND_WIN
+    if engine.board.is_board_full():
+        return DRAW
+    return UNFINISHED
+
+def record_game(engine):
+    board = engine.board
+    return GameRecord(board.height, board.width, board.moves, get_result(engine), board.win_length)
+
+def format_record(record):
+    moves = format_moves(record.moves, record.width)
+    size = f"{record.height}x{record.width}"
+    if record.win_length != FOUR:
+        size += f"x{record.win_length}"
+    return f"{size} {moves} {RESULT_NOTATION[record.result]}"
+
+def parse_record(line):
+    tokens = line.split()
+    if len(tokens) == 2:
+        # A game with no moves yet
+        tokens.insert(1, "")
+    try:
+        size, moves, result = tokens
+        height, width, *rest = (int(side) for side in size.split("x"))
+        if len(rest) > 1:
+            raise ValueError()
+        win_length = rest[0] if rest else FOUR
+        return GameRecord(height, width, parse_moves(moves, width), NOTATION_RESULTS[result], win_length)
+    except (ValueError, KeyError):
+        raise ValueError(f"Invalid game record: {line.strip()!r}") from None
+
+def pack_record(record):
+    moves = record.moves
+    if record.width <= NIBBLE_WIDTH:
+        padded = moves + [0] * (len(moves) % 2)
+        packed = bytes(padded[n] | padded[n + 1] << 4 for n in range(0, len(padded), 2))
+    else:
+        packed = bytes(moves)
+    header = GAME_HEADER.pack(record.height, record.width, record.win_length, record.result, len(moves))
+    return header + packed
+
+def get_packed_size(width, count):
+    return (count + 1) // 2 if width <= NIBBLE_WIDTH else count
+
+def unpack_moves(data, width, count):
+    if width > NIBBLE_WIDTH:
+        return list(data)
+    moves = []
+    for byte in data:
+        moves.append(byte & 0xF)
+        moves.append(byte >> 4)
+    return moves[:count]
+
+
+class GameRecordWriter:
+    # Writes records one at a time, packed or as text lines. Appending to
+    # an existing packed file keeps its header
+    def __init__(self, path, record_format=PACKED_FORMAT, append=False):
+        self.record_format = record_format
+        if record_format == PACKED_FORMAT:
+            self.file = open(path, "ab" if append else "wb")
+            if self.file.tell() == 0:
+                self.file.write(FILE_HEADER.pack(RECORDS_MAGIC, RECORDS_VERSION))
+        else:
+            self.file = open(path, "a" if append else "w")
+        self.count = 0
+
+    def write(self, record):
+        if self.record_format == PACKED_FORMAT:
+            self.file.write(pack_record(record))
+        else:
+            self.file.write(format_record(record) + "\n")
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_packed(game_file):
+    while True:
+        header = game_file.read(GAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < GAME_HEADER.size:
+            raise ValueError("Truncated game record")
+        height, width, win_length, result, count = GAME_HEADER.unpack(header)
+        size = get_packed_size(width, count)
+        data = game_file.read(size)
+        if len(data) < size:
+            raise ValueError("Truncated game record")
+        yield GameRecord(height, width, unpack_moves(data, width, count), result, win_length)
+
+def read_records(path):
+    # Yields every record in a packed or text file, one at a time, so files
+    # far bigger than memory can be scanned
+    with open(path, "rb") as game_file:
+        magic = game_file.read(len(RECORDS_MAGIC))
+        if magic == RECORDS_MAGIC:
+            version = game_file.read(1)
+            if version != bytes([RECORDS_VERSION]):
+                raise ValueError(f"{path} has an unsupported record version")
+            yield from read_packed(game_file)
+            return
+    with open(path) as game_file:
+        for line in game_file:
+            if line.strip():
+                yield parse_record(line)
+
+
+def replay(args):
+    for index, record in enumerate(read_records(args.input)):
+        if index == args.game:
+            break
+    else:
+        sys.exit(f"{args.input} has no game {args.game}")
+    ply = len(record.moves) if args.ply is None else min(args.ply, len(record.moves))
+    engine = record.get_engine(ply)
+    board = engine.board
+    board.spacing = board.get_spacing()
+    print(format_record(record))
+    if ply:
+        board.print_current_board(record.moves[ply - 1])
+    else:
+        board.print_default_board()
+    print(f"Ply {ply} of {len(record.moves)}, {RESULT_NOTATION[get_result(engine)]}")
+    if engine.legal_moves():
+        print(f"Score for the side to move: {engine.evaluate()}")
+        if args.depth:
+            print(f"Engine move: {engine.best_move(depth=args.depth) + 1}")
+
+def convert(args):
+    with GameRecordWriter(args.output, args.format) as writer:
+        for record in read_records(args.input):
+            writer.write(record)
+    print(f"Wrote {writer.count} games to {args.output}")
+
+def summarize(args):
+    counts = dict.fromkeys(RESULT_NOTATION.values(), 0)
+    games = 0
+    plies = 0
+    for record in read_records(args.input):
+        games += 1
+        plies += len(record.moves)
+        counts[RESULT_NOTATION[record.result]] += 1
+    print(f"{games} games, {plies / games if games else 0:.1f} plies per game")
+    print("  ".join(f"{notation} {count}" for notation, count in counts.items()))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inspect and convert game record files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = subparsers.add_parser("replay", help="Show a position from a recorded game")
+    replay_parser.add_argument("input", help="Packed or text record file")
+    replay_parser.add_argument("--game", type=int, default=0, help="0-based index of the game")
+    replay_parser.add_argument("--ply", type=int, help="Moves to replay (defaults to the whole game)")
+    replay_parser.add_argument("--depth", type=int, default=0,
+                               help="Also search the position to this depth")
+    replay_parser.set_defaults(run=replay)
+
+    convert_parser = subparsers.add_parser("convert", help="Rewrite records in another format")
+    convert_parser.add_argument("input", help="Packed or text record file")
+    convert_parser.add_argument("output", help="File to write")
+    convert_parser.add_argument("--format", choices=[PACKED_FORMAT, TEXT_FORMAT],
+                                default=PACKED_FORMAT, help="Format of the output")
+    convert_parser.set_defaults(run=convert)
+
+    summary_parser = subparsers.add_parser("summary", help="Count games and results")
+    summary_parser.add_argument("input", help="Packed or text record file")
+    summary_parser.set_defaults(run=summarize)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    args.run(args)
+
+
+
+if __name__ == "__main__":
+    main()
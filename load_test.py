@@ -0,0 +1,119 @@
+"""
+Load generator for server.py: many clients play games against the server
+at once with random moves, and the run is summarized as moves/sec and
+latency percentiles of the moves it answered.
+"""
+
+
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from connect_four import DEFAULT_HEIGHT, DEFAULT_WIDTH, MAX_DEPTH, FOUR
+from server import DEFAULT_HOST, DEFAULT_PORT, BUSY_ERROR, TIMEOUT_ERROR, Session
+
+
+
+DEFAULT_CLIENTS = 8
+DEFAULT_GAMES = 4
+PERCENTILES = (50, 90, 99)
+# Pause before retrying a move the server was too busy for, and how many
+# times to try before giving up on the game
+RETRY_DELAY = 0.05
+MAX_RETRIES = 20
+
+
+
+def get_percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index]
+
+async def send(reader, writer, request):
+    writer.write(json.dumps(request).encode() + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+async def run_client(args, rng, latencies, errors):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        for _ in range(args.games):
+            response = await send(reader, writer, {
+                "op": "new", "height": args.height, "width": args.width, "connect": args.connect,
+                "depth": args.depth, "time": args.time,
+            })
+            if "error" in response:
+                errors.append(response["error"])
+                continue
+            session_id = response["session"]
+            # Mirror the game locally to know which columns are open
+            game = Session(args.height, args.width, args.depth, args.time, args.connect)
+            retries = 0
+            while response.get("result") is None:
+                column = rng.choice([c for c in range(args.width) if game.is_column_open(c)])
+                start = time.perf_counter()
+                response = await send(reader, writer, {"op": "move", "session": session_id, "column": column})
+                if "error" in response:
+                    errors.append(response["error"])
+                    # Anything but a busy server won't get better by retrying
+                    if response["error"] not in (BUSY_ERROR, TIMEOUT_ERROR) or retries == MAX_RETRIES:
+                        break
+                    retries += 1
+                    await asyncio.sleep(RETRY_DELAY)
+                    continue
+                retries = 0
+                latencies.append(time.perf_counter() - start)
+                game.play(column)
+                if response["reply"] is not None:
+                    game.play(response["reply"])
+            await send(reader, writer, {"op": "close", "session": session_id})
+    finally:
+        writer.close()
+
+async def run_load(args):
+    latencies = []
+    errors = []
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_client(args, random.Random(rng.random()), latencies, errors)
+        for _ in range(args.clients)
+    ))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{args.clients} clients, {args.clients * args.games} games, {len(latencies)} moves in {elapsed:.1f}s")
+    print(f"{len(latencies) / elapsed:.1f} moves/sec, {len(errors)} errors")
+    print("  ".join(
+        f"p{percent} {get_percentile(latencies, percent) * 1000:.1f}ms" for percent in PERCENTILES
+    ))
+    for error in sorted(set(errors)):
+        print(f"  {errors.count(error)} x {error}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure a running game server under load")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Server address")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Server port")
+    parser.add_argument("--clients", type=int, default=DEFAULT_CLIENTS, help="Concurrent connections")
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES, help="Games per client")
+    parser.add_argument("--height", type=int, default=DEFAULT_HEIGHT, help="Height of the board")
+    parser.add_argument("--width", type=int, default=DEFAULT_WIDTH, help="Width of the board")
+    parser.add_argument("--connect", type=int, default=FOUR, help="Pieces in a row needed to win")
+    parser.add_argument("--depth", type=int, default=MAX_DEPTH, help="Search depth of the server")
+    parser.add_argument("--time", type=float, help="Seconds the server may search per move")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random moves")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    asyncio.run(run_load(args))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+Monte Carlo tree search: an engine for boards too big for alpha-beta to
+see far on. Moves are picked with UCT, every new node is scored by one
+playout to the end of the game and the search stops whenever its time or
+playout budget runs out. With more than one worker, each process grows a
+tree of its own from the same position and their root visits are added
+up (root parallelism).
+
+Playouts work on raw bitboards like the solver: current holds the pieces
+of the side to move and mask all pieces.
+"""
+
+
+
+import argparse
+import math
+import random
+import time
+
+from connect_four import (
+    Engine, MAX_DEPTH, WINNER_SCORE, DEFAULT_HEIGHT, DEFAULT_WIDTH, FOUR,
+)
+
+
+
+RANDOM_PLAYOUTS = "random"
+# Random moves, except that immediate wins are taken and lone threats blocked
+HEURISTIC_PLAYOUTS = "heuristic"
+DEFAULT_PLAYOUTS = 2000
+# UCT exploration constant, sqrt(2) in theory
+DEFAULT_EXPLORATION = 1.4
+WIN = 1.0
+DRAW = 0.5
+LOSS = 0.0
+
+
+
+class Node:
+    # wins and visits are counted for the side that played move
+    __slots__ = ("column", "move", "parent", "children", "untried", "visits", "wins", "result")
+
+    def __init__(self, column=-1, move=0, parent=None, result=None):
+        self.column = column
+        self.move = move
+        self.parent = parent
+        self.children = []
+        # Columns not yet expanded, filled in on the first visit
+        self.untried = None
+        self.visits = 0
+        self.wins = 0.0
+        # WIN or DRAW once move has ended the game
+        self.result = result
+
+    def select_child(self, exploration):
+        log_visits = math.log(self.visits)
+        best = None
+        best_value = -1.0
+        for child in self.children:
+            value = child.wins / child.visits + exploration * math.sqrt(log_visits / child.visits)
+            if value > best_value:
+                best = child
+                best_value = value
+        return best
+
+    def get_most_visited(self):
+        return max(self.children, key=lambda child: child.visits, default=None)
+
+
+class MCTSEngine(Engine):
+    # Same interface as Engine, with find_best_move searching by playouts.
+    # max_depth is ignored; node_limit (or playouts) caps the playouts
+    def __init__(self, height=DEFAULT_HEIGHT, width=DEFAULT_WIDTH, moves=None,
+                 playouts=DEFAULT_PLAYOUTS, playout_policy=HEURISTIC_PLAYOUTS,
+                 exploration=DEFAULT_EXPLORATION, seed=None, **kwargs):
+        super().__init__(height, width, moves, **kwargs)
+        self.playouts = playouts
+        self.playout_policy = playout_policy
+        self.exploration = exploration
+        self.rng = random.Random(seed)
+        self.search_seconds = 0.0
+
+    def get_columns(self, possible):
+        column_masks = self.board.column_masks
+        return [col for col in self.center_columns if possible & column_masks[col]]
+
+    def get_random_move(self, possible):
+        # One of the set bits of possible, all equally likely
+        for _ in range(self.rng.randrange(possible.bit_count())):
+            possible &= possible - 1
+        return possible & -possible
+
+    def playout(self, current, mask):
+        # Plays the game out from the view of the side to move: WIN, DRAW
+        # or LOSS for it
+        board = self.board
+        find_winning_cells = board.find_winning_cells
+        get_possible = board.get_possible
+        full = board.board_mask
+        heuristic = self.playout_policy == HEURISTIC_PLAYOUTS
+        to_move_wins = True
+        while mask != full:
+            possible = get_possible(mask)
+            wins = find_winning_cells(current, mask) & possible
+            if heuristic:
+                if wins:
+                    return WIN if to_move_wins else LOSS
+                blocks = find_winning_cells(current ^ mask, mask) & possible
+                move = blocks & -blocks if blocks else self.get_random_move(possible)
+            else:
+                move = self.get_random_move(possible)
+                if move & wins:
+                    return WIN if to_move_wins else LOSS
+            current, mask = current ^ mask, mask | move
+            to_move_wins = not to_move_wins
+        return DRAW
+
+    def expand(self, node, current, mask):
+        # Adds one untried child of node and returns it
+        if node.untried is None:
+            node.untried = self.get_columns(self.board.get_possible(mask))
+        column = node.untried.pop(self.rng.randrange(len(node.untried)))
+        move = self.board.get_possible(mask) & self.board.column_masks[column]
+        result = None
+        if move & self.board.find_winning_cells(current, mask):
+            result = WIN
+        elif mask | move == self.board.board_mask:
+            result = DRAW
+        child = Node(column, move, node, result)
+        node.children.append(child)
+        return child
+
+    def run_playout(self, root, current, mask):
+        # One round of selection, expansion, playout and backup
+        node = root
+        exploration = self.exploration
+        while node.result is None and node.untried == [] and node.children:
+            node = node.select_child(exploration)
+            current, mask = current ^ mask, mask | node.move
+        if node.result is None:
+            node = self.expand(node, current, mask)
+            current, mask = current ^ mask, mask | node.move
+        if node.result is None:
+            # The playout is for the side to move after node's move
+            value = 1.0 - self.playout(current, mask)
+        else:
+            value = node.result
+        while node is not None:
+            node.visits += 1
+            node.wins += value
+            value = 1.0 - value
+            node = node.parent
+
+    def search_tree(self, time_limit=None, playouts=None):
+        # Grows a tree from the current position until a limit runs out
+        board = self.board
+        current = board.bitboards[self.get_color_to_move()]
+        mask = board.occupied
+        root = Node()
+        deadline = None
+        if time_limit is not None:
+            deadline = time.perf_counter() + time_limit
+        if playouts is None:
+            playouts = self.playouts
+        stop_event = self.stop_event
+        while root.visits < playouts:
+            # Always finish one playout per root move, then check the clock
+            if root.visits > len(self.center_columns):
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                if stop_event is not None and stop_event.is_set():
+                    break
+            self.run_playout(root, current, mask)
+        return root
+
+    def get_forced_move(self):
+        # A win to take or a lone threat to block needs no search
+        board = self.board
+        color = self.get_color_to_move()
+        current = board.bitboards[color]
+        mask = board.occupied
+        possible = self.board.get_possible(mask)
+        wins = board.find_winning_cells(current, mask) & possible
+        if not wins:
+            wins = board.find_winning_cells(current ^ mask, mask) & possible
+            if wins & (wins - 1):
+                return None
+        if wins:
+            return ((wins & -wins).bit_length() - 1) // board.column_bits
+        return None
+
+    def find_best_move(self, max_depth=MAX_DEPTH, time_limit=None, node_limit=None):
+        self.principal_variation = []
+        if self.book is not None:
+            book_move = self.book.probe(self.board)
+            if book_move is not None and self.board.is_column_open(book_move):
+                self.principal_variation = [book_move]
+                return book_move
+        start = time.perf_counter()
+        playouts = self.playouts if node_limit is None else node_limit
+
+        forced_move = self.get_forced_move()
+        if forced_move is not None:
+            self.nodes = 0
+            self.search_seconds = time.perf_counter() - start
+            self.principal_variation = [forced_move]
+            return forced_move
+
+        if self.workers > 1:
+            visits, wins, self.nodes = self.search_parallel(time_limit, playouts)
+            line = []
+        else:
+            root = self.search_tree(time_limit, playouts)
+            visits = {child.column: child.visits for child in root.children}
+            wins = {child.column: child.wins for child in root.children}
+            self.nodes = root.visits
+            line = self.get_line(root)
+        self.search_seconds = time.perf_counter() - start
+
+        # The most visited move, center first on ties
+        best_move = max(self.get_columns(self.board.get_possible(self.board.occupied)),
+                        key=lambda col: visits.get(col, 0))
+        rate = wins.get(best_move, 0.0) / max(visits.get(best_move, 0), 1)
+        # Win rate on the same scale as the search's scores
+        self.best_score = round((2 * rate - 1) * WINNER_SCORE)
+        self.principal_variation = line if line and line[0] == best_move else [best_move]
+        return best_move
+
+    def search_parallel(self, time_limit, playouts):
+        executor = self.get_executor()
+        futures = [
+            executor.submit(search_worker, self, self.rng.random(), time_limit,
+                            -(-playouts // self.workers))
+            for _ in range(self.workers)
+        ]
+        visits = {}
+        wins = {}
+        total = 0
+        for future in futures:
+            children, count = future.result()
+            total += count
+            for column, child_visits, child_wins in children:
+                visits[column] = visits.get(column, 0) + child_visits
+                wins[column] = wins.get(column, 0.0) + child_wins
+        return visits, wins, total
+
+    def get_line(self, root):
+        # Most visited moves from the root down
+        line = []
+        node = root.get_most_visited()
+        while node is not None:
+            line.append(node.column)
+            node = node.get_most_visited()
+        return line
+
+    def get_playout_rate(self):
+        # Playouts per second of the last search
+        if not self.search_seconds:
+            return 0.0
+        return self.nodes / self.search_seconds
+
+
+def search_worker(engine, seed, time_limit, playouts):
+    # Runs in a worker process on a copy of the engine, with a seed of its
+    # own so the trees don't all play the same playouts
+    engine.rng = random.Random(seed)
+    root = engine.search_tree(time_limit, playouts)
+    children = [(child.column, child.visits, child.wins) for child in root.children]
+    return children, root.visits
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pick a move with Monte Carlo tree search, optionally against alpha-beta")
+    parser.add_argument("--height", type=int, default=DEFAULT_HEIGHT, help="Height of the board")
+    parser.add_argument("--width", type=int, default=DEFAULT_WIDTH, help="Width of the board")
+    parser.add_argument("--connect", type=int, default=FOUR, help="Pieces in a row needed to win")
+    parser.add_argument("--moves", default="", help="Position to search, as 1-based columns")
+    parser.add_argument("--time", type=float, default=1.0, help="Seconds to search for")
+    parser.add_argument("--playouts", type=int, default=10 ** 9,
+                        help="Stop after this many playouts even with time left")
+    parser.add_argument("--policy", choices=[HEURISTIC_PLAYOUTS, RANDOM_PLAYOUTS],
+                        default=HEURISTIC_PLAYOUTS, help="How playouts pick their moves")
+    parser.add_argument("--exploration", type=float, default=DEFAULT_EXPLORATION,
+                        help="UCT exploration constant")
+    parser.add_argument("--workers", type=int, default=1, help="Processes growing trees")
+    parser.add_argument("--seed", type=int, help="Seed for the playouts")
+    parser.add_argument("--depth", type=int, default=0,
+                        help="Also search the position with alpha-beta to this depth")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    engine = MCTSEngine(args.height, args.width, args.moves, playouts=args.playouts,
+                        playout_policy=args.policy, exploration=args.exploration, seed=args.seed,
+                        workers=args.workers, win_length=args.connect)
+    try:
+        move = engine.best_move(time_limit=args.time)
+    finally:
+        engine.close()
+    print(f"MCTS:       column {move + 1}, {engine.nodes} playouts in {engine.search_seconds:.2f}s "
+          f"({engine.get_playout_rate():.0f} playouts/sec), win rate "
+          f"{(engine.best_score / WINNER_SCORE + 1) / 2:.1%}")
+    if args.depth:
+        alpha_beta = Engine(args.height, args.width, args.moves, win_length=args.connect)
+        start = time.perf_counter()
+        move = alpha_beta.best_move(depth=args.depth)
+        seconds = time.perf_counter() - start
+        print(f"Alpha-beta: column {move + 1}, {alpha_beta.nodes} nodes to depth {args.depth} "
+              f"in {seconds:.2f}s ({alpha_beta.nodes / seconds if seconds else 0:.0f} nodes/sec)")
+
+
+
+if __name__ == "__main__":
+    main()
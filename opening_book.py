@@ -0,0 +1,190 @@
+"""
+Opening book: an offline generator that deep-searches every position up
+to a given ply, and a reader that memory-maps the resulting file so the
+engine can look moves up instead of searching them.
+
+File layout (little endian): a header of magic, height, width, plies,
+search depth and record count, then fixed-size records of position key,
+best column and score, sorted by key for binary search. A position and
+its mirror image share one record, keyed and oriented like whichever of
+the two has the smaller key.
+"""
+
+
+
+import argparse
+import mmap
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from connect_four import (
+    Engine, TT_MAX_ENTRIES, DEFAULT_HEIGHT, DEFAULT_WIDTH, RED_CIRCLE, YELLOW_CIRCLE, FOUR,
+)
+
+
+
+BOOK_MAGIC = b"C4BK"
+HEADER = struct.Struct("<4sHHHHI")
+RECORD = struct.Struct("<QBh")
+DEFAULT_PLIES = 4
+DEFAULT_BOOK_DEPTH = 8
+SCORE_LIMIT = 2 ** 15 - 1
+# Positions handed to a worker at a time
+CHUNK_SIZE = 16
+
+
+
+def get_book_key(board, mirror=True):
+    # Hash of the position with the first player's pieces counted as red,
+    # so a book works whichever color actually moved first. Returns the
+    # smaller of the position's and its mirror image's hash, and whether
+    # that was the mirror's (never, without mirror)
+    heights = [0] * board.width
+    key = 0
+    mirror_key = 0
+    for ply, column in enumerate(board.moves):
+        color = RED_CIRCLE if ply % 2 == 0 else YELLOW_CIRCLE
+        key ^= board.zobrist[color][column * board.column_bits + heights[column]]
+        mirror_key ^= board.zobrist[color][board.mirror_column(column) * board.column_bits + heights[column]]
+        heights[column] += 1
+    if mirror and mirror_key < key:
+        return mirror_key, True
+    return key, False
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.height, self.width, self.plies, self.depth, self.count = HEADER.unpack_from(self.data)
+        if magic != BOOK_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an opening book")
+
+    def get_record(self, index):
+        return RECORD.unpack_from(self.data, HEADER.size + index * RECORD.size)
+
+    def lookup(self, key):
+        # Binary search over the sorted records
+        low = 0
+        high = self.count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            record = self.get_record(middle)
+            if record[0] == key:
+                return record
+            elif record[0] < key:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return None
+
+    def probe(self, board):
+        # Books are only generated for Connect Four
+        if board.height != self.height or board.width != self.width or board.win_length != FOUR:
+            return None
+        if len(board.moves) > self.plies:
+            return None
+        key, mirrored = get_book_key(board)
+        record = self.lookup(key)
+        if record is None:
+            return None
+        if mirrored:
+            return board.mirror_column(record[1])
+        return record[1]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def enumerate_positions(height, width, plies):
+    # Every non-terminal position up to plies, once per transposition and
+    # mirror image, grouped by ply so one side is to move in each group
+    engine = Engine(height, width)
+    levels = [[[]]]
+    seen = {get_book_key(engine.board)[0]}
+    for _ in range(plies):
+        next_level = []
+        for moves in levels[-1]:
+            engine = Engine(height, width, moves)
+            for column in engine.legal_moves():
+                engine.play(column)
+                key = get_book_key(engine.board)[0]
+                if key not in seen and not engine.check_game_over():
+                    seen.add(key)
+                    next_level.append(moves + [column])
+                engine.undo()
+        levels.append(next_level)
+    return levels
+
+
+def search_position(task):
+    # Every position gets a table of its own, so what's left in it from
+    # other positions (which depends on --jobs) can't change the book
+    height, width, moves, depth, cache_path, tt_entries = task
+    engine = Engine(height, width, moves, tt_entries=tt_entries)
+    if cache_path is not None:
+        # Regenerating a book reuses searches at least as deep
+        from analysis_cache import get_cache
+        engine.cache = get_cache(cache_path)
+    engine.set_side(engine.get_color_to_move())
+    move = engine.find_best_move(depth)
+    score = max(-SCORE_LIMIT, min(SCORE_LIMIT, int(engine.best_score)))
+    key, mirrored = get_book_key(engine.board)
+    if mirrored:
+        move = engine.board.mirror_column(move)
+    return key, move, score
+
+def generate_book(path, height, width, plies, depth, jobs=1, cache_path=None, out=sys.stdout,
+                  tt_entries=TT_MAX_ENTRIES):
+    levels = enumerate_positions(height, width, plies)
+    tasks = [(height, width, moves, depth, cache_path, tt_entries) for level in levels for moves in level]
+    print(f"Searching {len(tasks)} positions to depth {depth}", file=out)
+    start = time.perf_counter()
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            records = list(executor.map(search_position, tasks, chunksize=CHUNK_SIZE))
+    else:
+        records = [search_position(task) for task in tasks]
+    records.sort()
+
+    with open(path, "wb") as book_file:
+        book_file.write(HEADER.pack(BOOK_MAGIC, height, width, plies, depth, len(records)))
+        for record in records:
+            book_file.write(RECORD.pack(*record))
+    print(f"Wrote {len(records)} positions to {path} in {time.perf_counter() - start:.1f}s", file=out)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate an opening book")
+    parser.add_argument("output", help="Book file to write")
+    parser.add_argument("--height", type=int, default=DEFAULT_HEIGHT, help="Height of the board")
+    parser.add_argument("--width", type=int, default=DEFAULT_WIDTH, help="Width of the board")
+    parser.add_argument("--plies", type=int, default=DEFAULT_PLIES,
+                        help="Cover every position with up to this many pieces")
+    parser.add_argument("--depth", type=int, default=DEFAULT_BOOK_DEPTH,
+                        help="Search depth for every book position")
+    parser.add_argument("--jobs", type=int, default=1, help="Processes to search in")
+    parser.add_argument("--cache", help="Analysis cache file to reuse and add to")
+    parser.add_argument("--tt-entries", type=int, default=TT_MAX_ENTRIES,
+                        help="Transposition table slots per search")
+    args = parser.parse_args()
+    if args.depth < 1:
+        parser.error("--depth must be at least 1")
+    if args.tt_entries < 1:
+        parser.error("--tt-entries must be at least 1")
+    return args
+
+def main():
+    args = parse_args()
+    generate_book(args.output, args.height, args.width, args.plies, args.depth, args.jobs, args.cache,
+                  tt_entries=args.tt_entries)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Pondering: while the human decides on a move, a background thread
+searches the position after each of their possible replies, with one
+transposition table per reply. Once the move comes in, the table (and,
+if it got that far, the finished search) for that reply is handed to the
+game and everything else is thrown away.
+"""
+
+
+
+import threading
+
+from connect_four import Engine, SearchTimeout
+
+
+
+class PonderResult:
+    # What pondering a reply left behind for the real search
+    def __init__(self, tt, move=None, score=None, principal_variation=None):
+        self.tt = tt
+        # Only set if the search reached the game's full depth
+        self.move = move
+        self.score = score
+        self.principal_variation = principal_variation or []
+
+
+class Ponderer:
+    def __init__(self, game):
+        self.game = game
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.workers = {}
+        self.results = {}
+
+    def make_worker(self, reply):
+        # An engine of its own for the position after reply, set up like
+        # the game and searching for the computer's side
+        game = self.game
+        board = game.board
+        first_color = board.get_color(board.moves[0], 0) if board.moves else game.player.color
+        worker = Engine(board.height, board.width, board.moves, first_color=first_color,
+                        max_depth=game.max_depth, evaluation=game.evaluation,
+                        solver_cells=game.solver_cells, move_ordering=game.move_ordering,
+                        win_length=board.win_length, tt_entries=game.tt_entries)
+        worker.set_side(game.computer.color)
+        worker.play(reply)
+        worker.stop_event = self.stop_event
+        # Book and cached moves come back without searching, same as in
+        # the game
+        worker.book = game.book
+        worker.cache = game.cache
+        return worker
+
+    def get_replies(self):
+        # The human's likeliest replies first: wins, blocks, then center-first
+        game = self.game
+        return game.order_moves(0, -1, game.player.color)
+
+    def start(self):
+        replies = self.get_replies()
+        self.stop_event.clear()
+        self.workers = {}
+        self.results = {}
+        self.thread = threading.Thread(target=self.run, args=(replies,), daemon=True)
+        self.thread.start()
+
+    def run(self, replies):
+        # Deepens every reply a ply at a time so each gets some work before
+        # any one of them goes deep
+        try:
+            for reply in replies:
+                self.workers[reply] = self.make_worker(reply)
+                if self.workers[reply].check_game_over():
+                    del self.workers[reply]
+            for depth in range(1, self.game.max_depth + 1):
+                for reply, worker in self.workers.items():
+                    move = worker.find_best_move(depth)
+                    if self.stop_event.is_set():
+                        return
+                    if depth == self.game.max_depth:
+                        self.results[reply] = (move, worker.best_score, worker.principal_variation)
+        except SearchTimeout:
+            pass
+
+    def finish(self, reply):
+        # Stops pondering and returns what was found for reply, or None
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        worker = self.workers.get(reply)
+        result = None
+        if worker is not None:
+            result = PonderResult(worker.tt, *self.results.get(reply, ()))
+        self.workers = {}
+        self.results = {}
+        return result
@@ -0,0 +1,179 @@
+"""
+Batch self-play: play many games between two agents across a process
+pool, stream every game to JSON lines and summarize the results.
+"""
+
+
+
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from connect_four import Engine, RED_CIRCLE, FOUR, format_moves, parse_moves
+from game_records import GameRecord, GameRecordWriter, FIRST_WIN, SECOND_WIN, DRAW
+from mcts import MCTSEngine
+
+
+
+RANDOM_AGENT = "random"
+DEPTH_AGENT = "depth"
+TIME_AGENT = "time"
+MCTS_AGENT = "mcts"
+# z-score for 95% confidence intervals
+CONFIDENCE_Z = 1.96
+# Games queued per process so workers never sit idle
+GAMES_PER_JOB = 4
+
+
+
+def parse_agent(spec):
+    # "random", "depth:<plies>", "time:<seconds per move>" or
+    # "mcts:<seconds per move>"
+    kind, _, value = spec.partition(":")
+    if kind == RANDOM_AGENT and not value:
+        return (RANDOM_AGENT, None)
+    try:
+        if kind == DEPTH_AGENT and int(value) >= 1:
+            return (DEPTH_AGENT, int(value))
+        elif kind in (TIME_AGENT, MCTS_AGENT):
+            return (kind, float(value))
+    except ValueError:
+        pass
+    raise ValueError(f"Unknown agent '{spec}', use random, depth:<n>, time:<seconds> or mcts:<seconds>")
+
+def get_agent_move(engine, agent, rng):
+    kind, value = agent
+    if kind == RANDOM_AGENT:
+        # Same policy as easy mode
+        return rng.choice(engine.legal_moves())
+    elif kind == DEPTH_AGENT:
+        return engine.best_move(depth=value)
+    elif kind == MCTS_AGENT:
+        # Playouts only stop for the clock
+        return engine.best_move(time_limit=value, node_limit=math.inf)
+    else:
+        board = engine.board
+        return engine.best_move(depth=board.height * board.width, time_limit=value)
+
+def play_game(height, width, agents, a_first, seed, opening_plies, win_length=FOUR):
+    # agents is (agent_a, agent_b). Each side searches with its own engine
+    # so their transposition tables never mix
+    rng = random.Random(seed)
+    engines = [
+        MCTSEngine(height, width, seed=rng.random(), win_length=win_length)
+        if agent[0] == MCTS_AGENT else Engine(height, width, win_length=win_length)
+        for agent in agents
+    ]
+    # Index of the agent that moves on even plies
+    first = 0 if a_first else 1
+    start = time.perf_counter()
+
+    while engines[0].legal_moves():
+        ply = len(engines[0].board.moves)
+        mover = first if ply % 2 == 0 else 1 - first
+        if ply < opening_plies:
+            # Random openings keep deterministic agents from replaying one game
+            column = rng.choice(engines[0].legal_moves())
+        else:
+            column = get_agent_move(engines[mover], agents[mover], rng)
+        for engine in engines:
+            engine.play(column)
+
+    is_winner, winner = engines[0].check_for_winner()
+    if not is_winner:
+        result = "draw"
+    elif (winner == RED_CIRCLE) == a_first:
+        result = "a"
+    else:
+        result = "b"
+    return {
+        "winner": result,
+        "a_first": a_first,
+        "moves": format_moves(engines[0].board.moves, width),
+        "plies": len(engines[0].board.moves),
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+
+def run_game(task):
+    index, height, width, agents, seed, opening_plies, win_length = task
+    # Agents swap who goes first every game
+    result = play_game(height, width, agents, index % 2 == 0, seed + index, opening_plies, win_length)
+    result["game"] = index
+    return result
+
+def iterate_results(tasks, jobs):
+    if jobs <= 1:
+        for task in tasks:
+            yield run_game(task)
+        return
+
+    # Keep only a few games per process in flight so memory stays flat
+    # however many games are requested
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        for task in tasks:
+            pending.add(executor.submit(run_game, task))
+            if len(pending) >= jobs * GAMES_PER_JOB:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+def wilson_interval(successes, total, z=CONFIDENCE_Z):
+    if total == 0:
+        return 0.0, 0.0
+    rate = successes / total
+    denominator = 1 + z * z / total
+    center = (rate + z * z / (2 * total)) / denominator
+    spread = z * math.sqrt(rate * (1 - rate) / total + z * z / (4 * total * total)) / denominator
+    return max(center - spread, 0.0), min(center + spread, 1.0)
+
+def print_summary(counts, games, seconds, agent_specs, out=sys.stdout):
+    print(f"{agent_specs[0]} (a) vs {agent_specs[1]} (b): {games} games", file=out)
+    for label, key in (("A wins", "a"), ("Draws", "draw"), ("B wins", "b")):
+        low, high = wilson_interval(counts[key], games)
+        rate = counts[key] / games if games else 0.0
+        print(f"{label + ':':8} {counts[key]:6}  {rate:6.1%}  (95% CI {low:.1%} - {high:.1%})", file=out)
+    print(f"{games / seconds if seconds else 0.0:.2f} games/sec", file=out)
+
+def get_record(result, height, width, win_length):
+    if result["winner"] == "draw":
+        outcome = DRAW
+    elif (result["winner"] == "a") == result["a_first"]:
+        outcome = FIRST_WIN
+    else:
+        outcome = SECOND_WIN
+    return GameRecord(height, width, parse_moves(result["moves"], width), outcome, win_length)
+
+def run_self_play(args):
+    try:
+        agents = (parse_agent(args.agent_a), parse_agent(args.agent_b))
+    except ValueError as error:
+        sys.exit(str(error))
+    tasks = (
+        (index, args.height, args.width, agents, args.seed, args.random_opening, args.connect)
+        for index in range(args.games)
+    )
+    counts = {"a": 0, "b": 0, "draw": 0}
+    output = open(args.output, "w") if args.output else None
+    records = GameRecordWriter(args.records) if args.records else None
+    start = time.perf_counter()
+
+    try:
+        for result in iterate_results(tasks, args.jobs):
+            counts[result["winner"]] += 1
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+            if records is not None:
+                records.write(get_record(result, args.height, args.width, args.connect))
+    finally:
+        if output is not None:
+            output.close()
+        if records is not None:
+            records.close()
+
+    print_summary(counts, args.games, time.perf_counter() - start, (args.agent_a, args.agent_b))
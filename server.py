@@ -0,0 +1,340 @@
+"""
+Game server: hosts many games at once over TCP, one JSON object per line
+each way. Sessions only keep the move list and two bitboards; hard mode
+searches run in a bounded process pool so the event loop never blocks.
+
+Requests (columns are 0-based):
+    {"op": "new", "height": 6, "width": 7, "connect": 4, "depth": 5, "time": 1.0, "computer_first": false}
+    {"op": "move", "session": 1, "column": 3}
+    {"op": "state", "session": 1}
+    {"op": "close", "session": 1}
+Every reply echoes the request's "id" if it had one, and carries either
+"error" or the session's "moves", "reply" (the computer's column, if it
+moved) and "result" (null, "player", "computer" or "draw").
+"""
+
+
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from analysis_cache import get_cache
+from connect_four import (
+    Engine, TT_MAX_ENTRIES, DEFAULT_HEIGHT, DEFAULT_WIDTH, MAX_DEPTH, FOUR, MIN_WIN_LENGTH,
+    format_moves,
+)
+
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7474
+DEFAULT_JOBS = 2
+# Searches allowed to wait for a process; past that, moves are refused
+# as busy instead of piling up
+DEFAULT_QUEUE = 32
+DEFAULT_MAX_SESSIONS = 10000
+# Seconds a move request may take, waiting for a process included
+DEFAULT_TIMEOUT = 10.0
+# Seconds of a request's time kept back from its search, for sending the
+# move back and for the search noticing its deadline
+SEARCH_MARGIN = 0.25
+MAX_BOARD_SIDE = 20
+PLAYER_WIN = "player"
+COMPUTER_WIN = "computer"
+DRAW = "draw"
+# Errors that go away on their own, so the move can be sent again
+BUSY_ERROR = "Server busy, try again later"
+TIMEOUT_ERROR = "Search timed out"
+
+
+
+class RequestError(Exception):
+    pass
+
+
+class Session:
+    # A game reduced to what the server has to hold on to between moves
+    __slots__ = ("height", "width", "win_length", "depth", "time_limit", "moves", "heights",
+                 "pieces", "column_bits", "result", "busy")
+
+    def __init__(self, height, width, depth, time_limit, win_length=FOUR):
+        self.height = height
+        self.width = width
+        self.win_length = win_length
+        self.depth = depth
+        self.time_limit = time_limit
+        self.moves = bytearray()
+        self.heights = bytearray(width)
+        # Same column-major layout as Board: one bitboard per side,
+        # indexed by whoever moved first
+        self.pieces = [0, 0]
+        self.column_bits = height + 1
+        self.result = None
+        self.busy = False
+
+    def is_column_open(self, column):
+        return 0 <= column < self.width and self.heights[column] < self.height
+
+    def play(self, column):
+        # Returns True if the move won the game
+        if self.result is not None:
+            raise RequestError("The game is over")
+        if not self.is_column_open(column):
+            raise RequestError(f"Column {column} is not a legal move")
+        side = len(self.moves) % 2
+        self.pieces[side] |= 1 << (column * self.column_bits + self.heights[column])
+        self.heights[column] += 1
+        self.moves.append(column)
+        return self.is_winning_mask(self.pieces[side])
+
+    def undo(self):
+        column = self.moves.pop()
+        self.heights[column] -= 1
+        self.pieces[len(self.moves) % 2] ^= 1 << (column * self.column_bits + self.heights[column])
+        self.result = None
+
+    def is_winning_mask(self, bitboard):
+        for shift in (1, self.column_bits, self.column_bits - 1, self.column_bits + 1):
+            line = bitboard
+            for _ in range(self.win_length - 1):
+                line &= line >> shift
+            if line:
+                return True
+        return False
+
+    def is_full(self):
+        return len(self.moves) == self.height * self.width
+
+    def as_dict(self):
+        return {
+            "moves": format_moves(self.moves, self.width),
+            "result": self.result,
+        }
+
+
+# Each worker keeps an engine, and with it a table, per board size and
+# side to move, shared by every session whose searches land on that
+# process. Boards and tables are only set up once that way
+worker_engines = {}
+
+def get_engine(height, width, win_length, moves, cache_path, tt_entries):
+    color_to_move = len(moves) % 2
+    key = (height, width, win_length, color_to_move)
+    engine = worker_engines.get(key)
+    if engine is None:
+        engine = Engine(height, width, win_length=win_length, tt_entries=tt_entries)
+        if cache_path is not None:
+            # Positions any worker (or an earlier run) searched are lookups
+            engine.cache = get_cache(cache_path)
+        worker_engines[key] = engine
+    while engine.board.moves:
+        engine.undo()
+    for column in moves:
+        engine.play(column)
+    return engine
+
+def search_move(height, width, win_length, moves, depth, time_limit, deadline, cache_path=None,
+                tt_entries=TT_MAX_ENTRIES):
+    # deadline is a time.time() the move has to be back by. The search
+    # gets whatever is left of it once the process picks the task up, so
+    # time spent queued for a process comes out of the search's budget
+    remaining = max(deadline - time.time(), 0.0)
+    time_limit = remaining if time_limit is None else min(time_limit, remaining)
+    engine = get_engine(height, width, win_length, moves, cache_path, tt_entries)
+    return engine.best_move(depth=depth, time_limit=time_limit)
+
+
+class GameServer:
+    def __init__(self, jobs=DEFAULT_JOBS, queue_size=DEFAULT_QUEUE,
+                 max_sessions=DEFAULT_MAX_SESSIONS, timeout=DEFAULT_TIMEOUT, cache_path=None,
+                 tt_entries=TT_MAX_ENTRIES):
+        self.executor = ProcessPoolExecutor(max_workers=jobs)
+        # One slot per search the pool may hold, running or queued
+        self.slots = asyncio.Semaphore(jobs + queue_size)
+        self.max_sessions = max_sessions
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.tt_entries = tt_entries
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.searches = 0
+
+    async def run_search(self, session, deadline):
+        # The slot is held until the worker actually finishes, even if the
+        # request timed out, so the pool can never be overfilled
+        await self.slots.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self.executor, search_move, session.height, session.width, session.win_length,
+            bytes(session.moves), session.depth, session.time_limit, deadline, self.cache_path,
+            self.tt_entries,
+        )
+        future.add_done_callback(lambda _: self.slots.release())
+        return await asyncio.shield(future)
+
+    async def computer_turn(self, session):
+        if self.slots.locked():
+            raise RequestError(BUSY_ERROR)
+        # Searches have to finish inside the request's own timeout, waiting
+        # for a slot and a process included, so a client can't tie up a
+        # process with a huge depth and a full budget still gets a move.
+        # Wall clock time, since the deadline is checked in another process
+        deadline = time.time() + max(self.timeout - SEARCH_MARGIN, 0.0)
+        session.busy = True
+        try:
+            column = await asyncio.wait_for(self.run_search(session, deadline), self.timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(TIMEOUT_ERROR) from None
+        finally:
+            session.busy = False
+        self.searches += 1
+        if session.play(column):
+            session.result = COMPUTER_WIN
+        elif session.is_full():
+            session.result = DRAW
+        return column
+
+    def get_session(self, request):
+        session = self.sessions.get(request.get("session"))
+        if session is None:
+            raise RequestError("Unknown session")
+        return session
+
+    async def new_session(self, request):
+        if len(self.sessions) >= self.max_sessions:
+            raise RequestError("Too many sessions")
+        height = int(request.get("height", DEFAULT_HEIGHT))
+        width = int(request.get("width", DEFAULT_WIDTH))
+        if not (FOUR <= height <= MAX_BOARD_SIDE and FOUR <= width <= MAX_BOARD_SIDE):
+            raise RequestError(f"Board sides must be between {FOUR} and {MAX_BOARD_SIDE}")
+        win_length = int(request.get("connect", FOUR))
+        if not MIN_WIN_LENGTH <= win_length <= max(height, width):
+            raise RequestError(f"connect must be between {MIN_WIN_LENGTH} and the board's longest side")
+        depth = int(request.get("depth", MAX_DEPTH))
+        if depth < 1:
+            raise RequestError("depth must be at least 1")
+        time_limit = request.get("time")
+        if time_limit is not None:
+            time_limit = float(time_limit)
+        session = Session(height, width, depth, time_limit, win_length)
+        reply = None
+        if request.get("computer_first"):
+            reply = await self.computer_turn(session)
+        session_id = next(self.session_ids)
+        self.sessions[session_id] = session
+        return dict(session.as_dict(), session=session_id, reply=reply)
+
+    async def move(self, request):
+        session = self.get_session(request)
+        if session.busy:
+            raise RequestError("The computer is still thinking")
+        try:
+            column = int(request["column"])
+        except (KeyError, TypeError, ValueError):
+            raise RequestError("Missing or invalid column") from None
+        reply = None
+        if session.play(column):
+            session.result = PLAYER_WIN
+        elif session.is_full():
+            session.result = DRAW
+        else:
+            try:
+                reply = await self.computer_turn(session)
+            except RequestError:
+                # Take the move back so the client can simply retry it
+                session.undo()
+                raise
+        return dict(session.as_dict(), reply=reply)
+
+    async def handle_request(self, request):
+        op = request.get("op")
+        if op == "new":
+            return await self.new_session(request)
+        elif op == "move":
+            return await self.move(request)
+        elif op == "state":
+            return self.get_session(request).as_dict()
+        elif op == "close":
+            self.get_session(request)
+            del self.sessions[request["session"]]
+            return {"closed": True}
+        raise RequestError(f"Unknown op {op!r}")
+
+    async def handle_client(self, reader, writer):
+        # Requests on one connection are answered in order, and the next
+        # line isn't read until the last reply has been flushed
+        try:
+            while line := await reader.readline():
+                request = {}
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise RequestError("Requests must be JSON objects")
+                    response = await self.handle_request(request)
+                except (RequestError, ValueError, TypeError, OverflowError) as error:
+                    response = {"error": str(error)}
+                if isinstance(request, dict) and "id" in request:
+                    response["id"] = request["id"]
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+async def serve(args):
+    if args.cache:
+        # Made once up front rather than by whichever worker gets there first
+        get_cache(args.cache)
+    server = GameServer(args.jobs, args.queue, args.max_sessions, args.timeout, args.cache,
+                        args.tt_entries)
+    listener = await asyncio.start_server(server.handle_client, args.host, args.port)
+    print(f"Serving on {args.host}:{args.port} with {args.jobs} search processes")
+    start = time.perf_counter()
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+        elapsed = time.perf_counter() - start
+        print(f"{server.searches} searches for {len(server.sessions)} open sessions in {elapsed:.0f}s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve Connect Four games over TCP")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Processes to search in")
+    parser.add_argument("--queue", type=int, default=DEFAULT_QUEUE,
+                        help="Searches allowed to wait for a process before requests are refused")
+    parser.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS,
+                        help="Games the server holds at once")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="Seconds a move may take, which also caps every search")
+    parser.add_argument("--cache", help="Analysis cache file the search processes share")
+    parser.add_argument("--tt-entries", type=int, default=TT_MAX_ENTRIES,
+                        help="Transposition table slots per board size and side in each process")
+    args = parser.parse_args()
+    if args.tt_entries < 1:
+        parser.error("--tt-entries must be at least 1")
+    return args
+
+def main():
+    args = parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+
+if __name__ == "__main__":
+    main()
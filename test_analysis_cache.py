@@ -0,0 +1,92 @@
+"""
+Round trips through the analysis cache: what's stored comes back, for
+mirror images too when the evaluation allows it, and full buckets give
+up their shallowest searches. Run with python -m unittest (or pytest).
+"""
+
+
+
+import os
+import tempfile
+import unittest
+
+from connect_four import Engine, WINDOW_EVALUATION, LEGACY_EVALUATION, SOLVER_SOURCE, EXACT
+from analysis_cache import AnalysisCache, BUCKET_SLOTS
+
+
+
+class AnalysisCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "test.c4c")
+        self.cache = AnalysisCache(self.path, size_mb=1)
+        self.addCleanup(self.cache.close)
+
+    def test_store_and_probe(self):
+        board = Engine(6, 7, "4453").board
+        self.cache.store(board, WINDOW_EVALUATION, 6, -35, 2)
+        self.assertEqual(self.cache.probe(board, WINDOW_EVALUATION, 6), (2, -35))
+        self.assertEqual(self.cache.probe(board, WINDOW_EVALUATION, 4), (2, -35))
+        # Not deep enough, or searched with another evaluation or board
+        self.assertIsNone(self.cache.probe(board, WINDOW_EVALUATION, 7))
+        self.assertIsNone(self.cache.probe(board, LEGACY_EVALUATION, 6))
+        self.assertIsNone(self.cache.probe(Engine(6, 8, "4453").board, WINDOW_EVALUATION, 6))
+        self.assertIsNone(self.cache.probe(Engine(6, 7, "4453", win_length=5).board,
+                                           WINDOW_EVALUATION, 6))
+
+    def test_reopened_file_keeps_entries(self):
+        board = Engine(6, 7, "1234").board
+        self.cache.store(board, WINDOW_EVALUATION, 9, 12, 5)
+        reader = AnalysisCache(self.path, read_only=True)
+        try:
+            self.assertEqual(reader.probe(board, WINDOW_EVALUATION, 9), (5, 12))
+            # Read-only caches ignore stores
+            reader.store(board, WINDOW_EVALUATION, 12, 0, 0)
+            self.assertEqual(reader.probe(board, WINDOW_EVALUATION, 9), (5, 12))
+        finally:
+            reader.close()
+
+    def test_mirror_images_share_entries(self):
+        board = Engine(6, 7, "1262").board
+        mirror = Engine(6, 7, "7626").board
+        self.cache.store(board, WINDOW_EVALUATION, 5, 8, 0)
+        self.assertEqual(self.cache.probe(mirror, WINDOW_EVALUATION, 5), (6, 8))
+        # The legacy evaluation doesn't score mirror images the same
+        self.cache.store(board, LEGACY_EVALUATION, 5, 8, 0)
+        self.assertEqual(self.cache.probe(board, LEGACY_EVALUATION, 5), (0, 8))
+        self.assertIsNone(self.cache.probe(mirror, LEGACY_EVALUATION, 5))
+
+    def test_shallower_search_keeps_deeper_entry(self):
+        board = Engine(6, 7, "44").board
+        self.cache.store(board, WINDOW_EVALUATION, 8, 20, 3)
+        self.cache.store(board, WINDOW_EVALUATION, 4, -20, 1)
+        self.assertEqual(self.cache.probe(board, WINDOW_EVALUATION, 8), (3, 20))
+        self.cache.store(board, WINDOW_EVALUATION, 10, 15, 2)
+        self.assertEqual(self.cache.probe(board, WINDOW_EVALUATION, 10), (2, 15))
+
+    def test_full_bucket_drops_shallowest(self):
+        # Keys a multiple of the bucket count apart all land in bucket 1
+        keys = [1 + n * self.cache.buckets for n in range(BUCKET_SLOTS + 1)]
+        depths = [5, 2, 7, 4]
+        for key, depth in zip(keys, depths):
+            self.cache.insert(key, depth, EXACT, 0, depth)
+        self.cache.insert(keys[-1], 3, EXACT, 0, 3)
+        self.assertIsNone(self.cache.lookup(keys[1]))
+        for key, depth in zip(keys[:1] + keys[2:], depths[:1] + depths[2:] + [3]):
+            self.assertEqual(self.cache.lookup(key), (depth, EXACT, 0, depth))
+
+    def test_solver_goes_before_cache(self):
+        # A cached search can't override an exact answer
+        solved = Engine(5, 5, "3334421155224")
+        move = solved.find_best_move(8)
+        engine = Engine(5, 5, "3334421155224", cache=self.cache)
+        self.cache.store(engine.board, WINDOW_EVALUATION, 20, 0, (move + 1) % 5)
+        self.assertEqual(engine.find_best_move(8), move)
+        self.assertEqual(engine.move_source, SOLVER_SOURCE)
+        self.assertEqual(engine.best_score, solved.best_score)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+"""
+Checks that the fast paths still agree with the slow, obvious versions
+of the same thing: the search against plain negamax, the NumPy batch
+evaluator against Engine.evaluate and the solver against brute force.
+Run with python -m unittest (or pytest).
+"""
+
+
+
+import random
+import unittest
+
+from connect_four import (
+    Engine, Solver, WINNER_SCORE, WIN_PLY_PENALTY, WINDOW_EVALUATION, LEGACY_EVALUATION,
+    SOLVER_SOURCE,
+)
+from batch_evaluation import np, encode_boards, evaluate_batch
+
+
+
+def random_engine(rng, height, width, plies, win_length=4, keep_finished=False, **kwargs):
+    # An engine after up to plies random moves, stopping early if the
+    # game ends (and starting over unless finished games are wanted)
+    while True:
+        engine = Engine(height, width, win_length=win_length, **kwargs)
+        for _ in range(plies):
+            if engine.check_game_over():
+                break
+            engine.play(rng.choice(engine.legal_moves()))
+        if keep_finished or not engine.check_game_over():
+            return engine
+
+def reference_negamax(engine, depth, max_depth):
+    # Engine.negamax without the table, move ordering or pruning
+    board = engine.board
+    if board.check_last_move()[0]:
+        return depth * WIN_PLY_PENALTY - WINNER_SCORE
+    if board.is_board_full():
+        return 0
+    if depth == max_depth:
+        score = engine.evaluation_function()
+        return score if depth % 2 else -score
+    to_move = engine.computer if depth % 2 else engine.player
+    best_score = -WINNER_SCORE * 2
+    for col in board.get_empty_columns():
+        board.update_board(col, to_move)
+        best_score = max(best_score, -reference_negamax(engine, depth + 1, max_depth))
+        board.undo_update(col)
+    return best_score
+
+def reference_root_scores(engine, depth):
+    # Score of every legal move of the side to move, searched depth plies
+    # past the move like Engine's iterations
+    engine.set_side(engine.get_color_to_move())
+    scores = {}
+    for col in engine.legal_moves():
+        engine.board.update_board(col, engine.computer)
+        scores[col] = -reference_negamax(engine, 0, depth)
+        engine.board.undo_update(col)
+    return scores
+
+def brute_force_score(engine):
+    # Solver scores by trying every line to the end: for a win, the
+    # winner's pieces left unplayed plus one, negative for a loss
+    size = engine.board.height * engine.board.width
+    best_score = -size
+    for col in engine.legal_moves():
+        moves = len(engine.board.moves)
+        engine.play(col)
+        if engine.check_for_winner()[0]:
+            score = (size + 1 - moves) // 2
+        elif engine.board.is_board_full():
+            score = 0
+        else:
+            score = -brute_force_score(engine)
+        engine.undo()
+        best_score = max(best_score, score)
+    return best_score
+
+
+class SearchTest(unittest.TestCase):
+    def check_positions(self, height, width, win_length, depths, count, seed):
+        rng = random.Random(seed)
+        for n in range(count):
+            depth = depths[n % len(depths)]
+            engine = random_engine(rng, height, width, rng.randrange(height * width // 2),
+                                   win_length, solver_cells=0)
+            position = engine.get_position()
+            expected = reference_root_scores(engine, depth)
+            move = engine.best_move(depth=depth)
+            with self.subTest(position=position, depth=depth):
+                self.assertEqual(engine.best_score, max(expected.values()))
+                self.assertEqual(expected[move], engine.best_score)
+                self.assertEqual(engine.principal_variation[0], move)
+
+    def test_matches_plain_negamax(self):
+        self.check_positions(6, 7, 4, (1, 2, 3, 4), 24, seed=1)
+
+    def test_matches_plain_negamax_other_boards(self):
+        self.check_positions(5, 5, 4, (2, 3, 4), 12, seed=2)
+        self.check_positions(5, 6, 3, (2, 3), 12, seed=3)
+
+    def test_parallel_matches_serial(self):
+        rng = random.Random(4)
+        engine = random_engine(rng, 6, 7, 8, solver_cells=0, workers=2)
+        try:
+            expected = reference_root_scores(engine, 3)
+            move = engine.best_move(depth=3)
+        finally:
+            engine.close()
+        self.assertEqual(engine.best_score, max(expected.values()))
+        self.assertEqual(expected[move], engine.best_score)
+
+
+@unittest.skipIf(np is None, "batch evaluation needs NumPy")
+class BatchEvaluationTest(unittest.TestCase):
+    def check_positions(self, height, width, win_length, evaluation, seed):
+        rng = random.Random(seed)
+        engines = [
+            random_engine(rng, height, width, rng.randrange(height * width + 1), win_length,
+                          keep_finished=True, evaluation=evaluation)
+            for _ in range(200)
+        ]
+        win, winner, scores = evaluate_batch(
+            encode_boards([engine.board for engine in engines]), evaluation=evaluation,
+            win_length=win_length)
+        for n, engine in enumerate(engines):
+            with self.subTest(position=engine.get_position()):
+                self.assertEqual(bool(win[n]), engine.check_for_winner()[0])
+                self.assertEqual(int(scores[n]), engine.evaluate())
+
+    def test_window_evaluation(self):
+        self.check_positions(6, 7, 4, WINDOW_EVALUATION, seed=5)
+        self.check_positions(7, 9, 5, WINDOW_EVALUATION, seed=6)
+
+    def test_legacy_evaluation(self):
+        self.check_positions(6, 7, 4, LEGACY_EVALUATION, seed=7)
+        self.check_positions(5, 6, 3, LEGACY_EVALUATION, seed=8)
+
+
+class SolverTest(unittest.TestCase):
+    def check_positions(self, height, width, win_length, empty_cells, count, seed):
+        rng = random.Random(seed)
+        solver = Solver(height, width, win_length)
+        for _ in range(count):
+            engine = random_engine(rng, height, width, height * width - empty_cells, win_length)
+            position = engine.get_position()
+            expected = brute_force_score(engine)
+            analysis = solver.analyze(engine.board, engine.get_color_to_move())
+            with self.subTest(position=position):
+                self.assertEqual(analysis["score"], expected)
+                # The move it suggests keeps the score
+                moves = len(engine.board.moves)
+                engine.play(analysis["move"])
+                if engine.check_for_winner()[0]:
+                    self.assertEqual((height * width + 1 - moves) // 2, expected)
+                elif engine.board.is_board_full():
+                    self.assertEqual(0, expected)
+                else:
+                    self.assertEqual(-brute_force_score(engine), expected)
+
+    def test_matches_brute_force(self):
+        self.check_positions(4, 4, 4, 10, 20, seed=9)
+        self.check_positions(4, 5, 4, 9, 20, seed=10)
+        self.check_positions(5, 4, 3, 9, 20, seed=11)
+
+    def test_solved_score_matches_full_search(self):
+        # The engine reports solver results on the search's scale
+        rng = random.Random(12)
+        for _ in range(10):
+            solved = random_engine(rng, 5, 5, 16)
+            searched = Engine(5, 5, solved.board.moves, solver_cells=0)
+            solved.best_move(depth=25)
+            searched.best_move(depth=25)
+            with self.subTest(position=solved.get_position()):
+                self.assertEqual(solved.move_source, SOLVER_SOURCE)
+                self.assertEqual(solved.best_score, searched.best_score)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
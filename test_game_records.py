@@ -0,0 +1,98 @@
+"""
+Round trips through the game record formats: games written packed or as
+text read back the same, on boards narrow enough for two moves to a
+byte and wider ones. Run with python -m unittest (or pytest).
+"""
+
+
+
+import os
+import random
+import tempfile
+import unittest
+
+from connect_four import Engine
+from game_records import (
+    GameRecord, GameRecordWriter, PACKED_FORMAT, TEXT_FORMAT, UNFINISHED, FIRST_WIN, DRAW,
+    NIBBLE_WIDTH, read_records, record_game, format_record, parse_record, pack_record,
+)
+
+
+
+def random_records(rng, height, width, win_length, count):
+    # Finished and unfinished games, including one with no moves
+    records = [GameRecord(height, width, [], UNFINISHED, win_length)]
+    for _ in range(count):
+        engine = Engine(height, width, win_length=win_length)
+        plies = rng.randrange(height * width + 1)
+        while len(engine.board.moves) < plies and not engine.check_game_over():
+            engine.play(rng.choice(engine.legal_moves()))
+        records.append(record_game(engine))
+    return records
+
+
+class GameRecordTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        rng = random.Random(13)
+        self.records = (random_records(rng, 6, 7, 4, 30) + random_records(rng, 9, 10, 5, 10)
+                        + random_records(rng, 6, NIBBLE_WIDTH, 4, 10)
+                        + random_records(rng, 5, NIBBLE_WIDTH + 2, 4, 10))
+
+    def write_and_read(self, record_format, name):
+        path = os.path.join(self.directory, name)
+        with GameRecordWriter(path, record_format) as writer:
+            for record in self.records:
+                writer.write(record)
+        self.assertEqual(writer.count, len(self.records))
+        return path, list(read_records(path))
+
+    def test_packed_round_trip(self):
+        _, records = self.write_and_read(PACKED_FORMAT, "games.c4g")
+        self.assertEqual(records, self.records)
+
+    def test_text_round_trip(self):
+        _, records = self.write_and_read(TEXT_FORMAT, "games.txt")
+        self.assertEqual(records, self.records)
+        for record in self.records:
+            self.assertEqual(parse_record(format_record(record)), record)
+
+    def test_packed_sizes(self):
+        # Two moves to a byte up to NIBBLE_WIDTH columns, one past it
+        empty = len(pack_record(GameRecord(6, 7, [])))
+        narrow = GameRecord(6, NIBBLE_WIDTH, [NIBBLE_WIDTH - 1] * 5)
+        wide = GameRecord(5, NIBBLE_WIDTH + 2, [NIBBLE_WIDTH + 1] * 5)
+        self.assertEqual(len(pack_record(narrow)), empty + 3)
+        self.assertEqual(len(pack_record(wide)), empty + 5)
+
+    def test_append_keeps_header(self):
+        path, _ = self.write_and_read(PACKED_FORMAT, "games.c4g")
+        with GameRecordWriter(path, PACKED_FORMAT, append=True) as writer:
+            writer.write(self.records[1])
+        self.assertEqual(list(read_records(path)), self.records + [self.records[1]])
+
+    def test_truncated_file(self):
+        path, _ = self.write_and_read(PACKED_FORMAT, "games.c4g")
+        with open(path, "r+b") as game_file:
+            game_file.truncate(os.path.getsize(path) - 1)
+        with self.assertRaises(ValueError):
+            list(read_records(path))
+
+    def test_results(self):
+        self.assertEqual(record_game(Engine(6, 7, "1212121")).result, FIRST_WIN)
+        self.assertEqual(parse_record("6x7 1212121 1-0"), GameRecord(6, 7, [0, 1] * 3 + [0], FIRST_WIN))
+        self.assertEqual(parse_record("4x4x3 *"), GameRecord(4, 4, [], UNFINISHED, 3))
+        self.assertEqual(record_game(Engine(4, 4, "4321311144234232")).result, DRAW)
+
+    def test_replay_positions(self):
+        for record in self.records:
+            self.assertEqual(record.get_engine(len(record.moves) // 2).board.moves,
+                             record.moves[:len(record.moves) // 2])
+            self.assertEqual(record_game(record.get_engine()), record)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Round trips through a small opening book: every position it was built
+from probes back to the move a search picks, whichever color moved first
+and for mirror images too. Run with python -m unittest (or pytest).
+"""
+
+
+
+import io
+import os
+import tempfile
+import unittest
+
+from connect_four import Engine, YELLOW_CIRCLE
+from opening_book import OpeningBook, enumerate_positions, generate_book, get_book_key
+
+
+
+HEIGHT = 4
+WIDTH = 5
+PLIES = 3
+DEPTH = 4
+
+
+class OpeningBookTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.directory.name, "test.bin")
+        generate_book(path, HEIGHT, WIDTH, PLIES, DEPTH, out=io.StringIO())
+        cls.book = OpeningBook(path)
+        cls.positions = [moves for level in enumerate_positions(HEIGHT, WIDTH, PLIES)
+                         for moves in level]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.book.close()
+        cls.directory.cleanup()
+
+    def test_header(self):
+        self.assertEqual((self.book.height, self.book.width, self.book.plies, self.book.depth),
+                         (HEIGHT, WIDTH, PLIES, DEPTH))
+        self.assertEqual(self.book.count, len(self.positions))
+
+    def test_probe_matches_search(self):
+        for moves in self.positions:
+            engine = Engine(HEIGHT, WIDTH, moves)
+            with self.subTest(position=engine.get_position()):
+                self.assertEqual(self.book.probe(engine.board), engine.best_move(depth=DEPTH))
+
+    def test_yellow_first(self):
+        # Keys count the first player's pieces as red
+        for moves in self.positions:
+            red = Engine(HEIGHT, WIDTH, moves)
+            yellow = Engine(HEIGHT, WIDTH, moves, first_color=YELLOW_CIRCLE)
+            with self.subTest(position=red.get_position()):
+                self.assertIsNotNone(self.book.probe(yellow.board))
+                self.assertEqual(self.book.probe(yellow.board), self.book.probe(red.board))
+
+    def test_mirror_images(self):
+        for moves in self.positions:
+            engine = Engine(HEIGHT, WIDTH, moves)
+            mirror = Engine(HEIGHT, WIDTH, [WIDTH - 1 - column for column in moves])
+            move = self.book.probe(engine.board)
+            # A symmetric position is its own mirror image, move and all
+            if get_book_key(engine.board, False) != get_book_key(mirror.board, False):
+                move = engine.board.mirror_column(move)
+            with self.subTest(position=engine.get_position()):
+                self.assertEqual(self.book.probe(mirror.board), move)
+
+    def test_outside_the_book(self):
+        self.assertIsNone(self.book.probe(Engine(HEIGHT, WIDTH, "1234").board))
+        self.assertIsNone(self.book.probe(Engine(HEIGHT, WIDTH + 1, "3").board))
+        self.assertIsNone(self.book.probe(Engine(HEIGHT, WIDTH, "3", win_length=3).board))
+
+
+
+if __name__ == "__main__":
+    unittest.main()